@@ -0,0 +1,85 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import torch
+from utils.backends import BACKENDS, model_size
+from utils.inference import score_texts
+from utils.model_registry import MODELS, load_model
+
+def score(tokenizer, model, tweets, batch_size):
+    # Probabilities and throughput in tweets/s
+    score_texts(tokenizer, model, tweets[:batch_size], batch_size=batch_size)  # Warm up
+    start = time.perf_counter()
+    probs = score_texts(tokenizer, model, tweets, batch_size=batch_size)
+    return probs, len(tweets) / (time.perf_counter() - start)
+
+def parity(reference, probs):
+    """
+    Compare a backend's probabilities with the fp32 reference.
+
+    Returns
+    -------
+    result (dict):  Largest and mean absolute difference, and the share of
+                    tweets whose top label is unchanged.
+
+    """
+    difference = np.abs(probs - reference)
+    return {
+        'max_abs_diff': float(difference.max()),
+        'mean_abs_diff': float(difference.mean()),
+        'top_label_agreement': float((probs.argmax(axis=1) == reference.argmax(axis=1)).mean())
+    }
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Check the accuracy and speed of the '
+                                                 'quantized and ONNX backends against fp32.')
+    parser.add_argument('--data', default='./src/data/datasets/travelink_data.csv',
+                        help='Dataset with a tweet column.')
+    parser.add_argument('--n', type=int, default=512,
+                        help='Number of tweets to score.')
+    parser.add_argument('--models', nargs='+', default=list(MODELS), choices=list(MODELS))
+    parser.add_argument('--backends', nargs='+', default=['int8'],
+                        choices=[backend for backend in BACKENDS if backend != 'fp32'])
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Number of torch CPU threads.')
+    parser.add_argument('--min-agreement', type=float, default=0.98,
+                        help='Smallest accepted top-label agreement with fp32.')
+    parser.add_argument('--tiny-models', action='store_true',
+                        help='Use tiny random-weight stand-ins (offline smoke test).')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if args.tiny_models:
+        from tiny_models import register_tiny_models
+        register_tiny_models()
+
+    tweets = pd.read_csv(args.data)['tweet'].astype(str).tolist()[:args.n]
+    print(f'\nScoring {len(tweets)} tweets on {torch.get_num_threads()} CPU threads\n')
+
+    failed = []
+    for name in args.models:
+        tokenizer, model = load_model(name, 'fp32')
+        reference, baseline = score(tokenizer, model, tweets, args.batch_size)
+        print(f'{name} fp32: {baseline:8.1f} tweets/s, {model_size(model) / 1e6:7.1f} MB')
+
+        for backend in args.backends:
+            tokenizer, converted = load_model(name, backend)
+            probs, rate = score(tokenizer, converted, tweets, args.batch_size)
+            result = parity(reference, probs)
+            print(f'{name} {backend}: {rate:8.1f} tweets/s ({rate / baseline:.1f}x), '
+                  f'{model_size(converted) / 1e6:7.1f} MB, '
+                  f'max diff {result["max_abs_diff"]:.4f}, '
+                  f'mean diff {result["mean_abs_diff"]:.4f}, '
+                  f'top label agreement {result["top_label_agreement"]:.1%}')
+            if result['top_label_agreement'] < args.min_agreement:
+                failed.append(f'{name} {backend}')
+        print()
+
+    if failed:
+        print('Below the accepted agreement with fp32:', ', '.join(failed), '\n')
+        raise SystemExit(1)
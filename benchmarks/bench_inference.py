@@ -0,0 +1,53 @@
+import argparse
+import time
+import pandas as pd
+import torch
+from scipy.special import softmax
+from utils.inference import score_texts
+from utils.model_registry import get_model
+
+def score_per_row(tokenizer, model, tweets):
+    # The previous path: one tokenizer call and one forward pass per tweet,
+    # with autograd enabled
+    results = []
+    for tweet in tweets:
+        inputs = tokenizer(tweet, return_tensors='pt', truncation=True, max_length=512)
+        outputs = model(**inputs)
+        results.append(softmax(outputs.logits.detach().numpy()[0]))
+    return results
+
+def measure(score, tweets):
+    start = time.perf_counter()
+    score(tweets)
+    return len(tweets) / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compare per-row and batched sentiment scoring.')
+    parser.add_argument('--data', default='./src/data/datasets/travelink_data.csv',
+                        help='Dataset with a tweet column.')
+    parser.add_argument('--n', type=int, default=256,
+                        help='Number of tweets to score.')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32, 64],
+                        help='Batch sizes to benchmark.')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Number of torch CPU threads.')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    tweets = pd.read_csv(args.data)['tweet'].astype(str).tolist()[:args.n]
+    tokenizer, model = get_model('sentiment')
+
+    # Warm up
+    score_texts(tokenizer, model, tweets[:8])
+
+    print(f'\nScoring {len(tweets)} tweets on {torch.get_num_threads()} CPU threads\n')
+    baseline = measure(lambda texts: score_per_row(tokenizer, model, texts), tweets)
+    print(f'{"per-row":>12}: {baseline:8.1f} tweets/s')
+    for batch_size in args.batch_sizes:
+        rate = measure(lambda texts: score_texts(tokenizer, model, texts,
+                                                 batch_size=batch_size), tweets)
+        print(f'{f"batch {batch_size}":>12}: {rate:8.1f} tweets/s ({rate / baseline:.1f}x)')
+    print()
@@ -0,0 +1,306 @@
+import argparse
+import json
+import os
+import platform
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import torch
+from utils.cluster_model import ClusterModel
+from utils.feature_store import FEATURE_COLUMNS, get_cluster_features, tweet_hash
+from utils.interest_sentiment import SENTIMENT_LABELS, get_sentiment
+from utils.model_registry import get_model
+from utils.psychology_sentiment import PERSONALITY_LABELS, predict_personality
+from utils.score_cache import SCORE_CACHE_ENV
+from utils.synthetic_data import generate_dataset
+from utils.trip_index import TripIndex
+from utils.utils import (
+    get_basic_similar_travellers,
+    get_premium_interest_local_travellers,
+    get_premium_interest_matching_travellers,
+    get_premium_psychology_local_travellers,
+    get_premium_psychology_matching_travellers,
+    get_simultaneous_travellers
+)
+
+BASELINE_PATH = './benchmarks/baseline.json'
+PERCENTILES = [50, 90, 99]
+
+# Simultaneous users in the concurrent inference case
+SESSIONS = 16
+
+# Untimed calls of each case before it is timed, and passes over the inputs;
+# cases are compared on the median of the passes' medians
+WARMUP_RUNS = 3
+ROUNDS = 3
+
+# Setup
+# -----
+
+def random_feature_store(df, seed=0):
+    """
+    Feature store with random but well-formed features (sentiment rows sum
+    to one), so the matching paths can be benchmarked on any dataset size
+    without scoring every tweet first.
+
+    """
+    rng = np.random.default_rng(seed)
+    store = pd.DataFrame(index=pd.Index(df['Trip ID'].values, name='Trip ID'))
+    store['tweet_hash'] = df['tweet'].map(tweet_hash).values
+    store[SENTIMENT_LABELS] = rng.dirichlet(np.ones(len(SENTIMENT_LABELS)), size=len(df))
+    store[PERSONALITY_LABELS] = rng.random((len(df), len(PERSONALITY_LABELS)))
+    store[FEATURE_COLUMNS] = store[FEATURE_COLUMNS].astype('float32')
+    return store
+
+def new_travellers(df, n, seed=0):
+    # One-row DataFrames of existing trips posing as new travellers
+    rows = np.random.default_rng(seed).choice(len(df), size=n, replace=len(df) < n)
+    travellers = []
+    for row in rows:
+        traveller = df.iloc[[row]].reset_index(drop=True)
+        traveller['Trip ID'] = 'None'
+        traveller['Traveller Name'] = 'Me'
+        travellers.append(traveller)
+    return travellers
+
+def matching_cases(df, seed=0):
+    """
+    The matching hot paths on one dataset, each a function of a one-row
+    new traveller DataFrame.
+
+    """
+    trip_index = TripIndex(df)
+    simultaneous = lambda new: get_simultaneous_travellers(df, new.iloc[0], trip_index)
+    store = random_feature_store(df, seed)
+    interest_model = ClusterModel(SENTIMENT_LABELS).fit(get_cluster_features('interest', df, store))
+    psychology_model = ClusterModel(PERSONALITY_LABELS).fit(get_cluster_features('psychology', df, store))
+
+    return {
+        'simultaneous (scan)':
+            lambda new: get_simultaneous_travellers(df, new.iloc[0]),
+        'simultaneous (index)':
+            lambda new: get_simultaneous_travellers(df, new.iloc[0], trip_index),
+        'basic':
+            lambda new: get_basic_similar_travellers(simultaneous(new), new.iloc[0]),
+        'premium interest (model)':
+            lambda new: get_premium_interest_matching_travellers(df, new, store, interest_model),
+        'premium interest (local)':
+            lambda new: get_premium_interest_local_travellers(simultaneous(new), new,
+                                                              interest_model, store),
+        'premium interest (refit)':
+            lambda new: get_premium_interest_matching_travellers(df, new, store),
+        'premium psychology (model)':
+            lambda new: get_premium_psychology_matching_travellers(df, new, store, psychology_model),
+        'premium psychology (local)':
+            lambda new: get_premium_psychology_local_travellers(simultaneous(new), new,
+                                                                psychology_model, store),
+        'premium psychology (refit)':
+            lambda new: get_premium_psychology_matching_travellers(df, new, store)
+    }
+
+def inference_cases(tweets, batch_sizes):
+    # Model cases, independent of the dataset size
+    cases = {f'predict_personality (batch {batch_size}, {len(tweets)} tweets)':
+             lambda _, batch_size=batch_size: predict_personality(tweets, batch_size=batch_size)
+             for batch_size in batch_sizes}
+    cases['get_sentiment (1 tweet)'] = lambda tweet: get_sentiment(tweet)
+    cases[f'get_sentiment ({SESSIONS} concurrent sessions)'] = \
+        lambda _: concurrent_sessions(get_sentiment, tweets[:SESSIONS])
+    return cases
+
+def concurrent_sessions(function, tweets):
+    # One tweet per simultaneous session, as when many users submit at once
+    with ThreadPoolExecutor(max_workers=len(tweets)) as executor:
+        return list(executor.map(function, tweets))
+
+# Measurement
+# -----------
+
+def warm_up(seed=0):
+    """
+    Load everything the cases load lazily before anything is timed: both
+    models through the registry (and their micro-batchers), and the
+    matching and clustering paths on a small dataset.
+
+    """
+    for name in ['sentiment', 'personality']:
+        get_model(name)
+    get_sentiment('Warming up')
+    predict_personality(['Warming up'])
+    df = generate_dataset(200, seed=seed)
+    travellers = new_travellers(df, WARMUP_RUNS, seed)
+    for function in matching_cases(df, seed).values():
+        for traveller in travellers:
+            function(traveller)
+
+def measure(function, inputs, memory_runs=3, rounds=ROUNDS, warmup_runs=WARMUP_RUNS):
+    """
+    Time function on every input, rounds times after warmup_runs untimed
+    calls, and measure its peak Python heap usage. tracemalloc sees numpy
+    and pandas buffers but not torch's allocator, so it runs separately
+    from the timings.
+
+    Returns
+    -------
+    result (dict):  Timing percentiles and mean over all runs and the median
+                    of the rounds' medians in ms, peak memory in MB.
+
+    """
+    for run in range(warmup_runs):
+        function(inputs[run % len(inputs)])
+    timings = []
+    round_medians = []
+    for _ in range(rounds):
+        round_timings = []
+        for value in inputs:
+            start = time.perf_counter()
+            function(value)
+            round_timings.append((time.perf_counter() - start) * 1e3)
+        round_medians.append(np.median(round_timings))
+        timings += round_timings
+
+    tracemalloc.start()
+    for value in inputs[:memory_runs]:
+        function(value)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {f'p{percentile}_ms': float(np.percentile(timings, percentile))
+              for percentile in PERCENTILES}
+    result['mean_ms'] = float(np.mean(timings))
+    result['median_ms'] = float(np.median(round_medians))
+    result['peak_mb'] = peak / 1e6
+    result['runs'] = len(timings)
+    return result
+
+def run_benchmarks(sizes, repeat, batch_sizes, n_tweets, cases=None, seed=0):
+    """
+    Run every benchmark case, the matching cases on each dataset size.
+
+    Returns
+    -------
+    results (dict):  '<case> @ <size>' -> measurement.
+
+    """
+    results = {}
+    selected = lambda name: cases is None or any(case in name for case in cases)
+    warm_up(seed)
+
+    for size in sizes:
+        df = generate_dataset(size, seed=seed)
+        travellers = new_travellers(df, repeat, seed)
+        for name, function in matching_cases(df, seed).items():
+            if selected(name):
+                results[f'{name} @ {size}'] = measure(function, travellers)
+                print(format_row(f'{name} @ {size}', results[f'{name} @ {size}']), flush=True)
+
+    tweets = generate_dataset(max(n_tweets, repeat), seed=seed)['tweet'].tolist()
+    for name, function in inference_cases(tweets[:n_tweets], batch_sizes).items():
+        if selected(name):
+            inputs = tweets[:repeat] if name.startswith('get_sentiment') else [None] * min(repeat, 5)
+            results[name] = measure(function, inputs)
+            print(format_row(name, results[name]), flush=True)
+    return results
+
+# Reporting
+# ---------
+
+def format_row(name, result, baseline=None):
+    row = (f'{name:<52} {result["median_ms"]:10.2f} {result["p90_ms"]:10.2f} '
+           f'{result["p99_ms"]:10.2f} {result["peak_mb"]:9.1f}')
+    if baseline is not None:
+        row += f' {result["median_ms"] / baseline["median_ms"]:8.2f}x'
+    return row
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'torch_threads': torch.get_num_threads()
+    }
+
+def compare(results, baseline, tolerance, min_slowdown_ms=0.0):
+    """
+    Print the results next to a stored baseline and return the cases whose
+    median (of the rounds' medians) got slower than the baseline by more
+    than tolerance and by more than min_slowdown_ms, so that the noise of
+    cases taking a few ms is not reported.
+
+    """
+    regressions = []
+    print(f'\n{"case":<52} {"median ms":>10} {"p90 ms":>10} {"p99 ms":>10} '
+          f'{"peak MB":>9} {"vs base":>9}')
+    for name, result in results.items():
+        reference = baseline['results'].get(name)
+        print(format_row(name, result, reference))
+        if reference is None:
+            continue
+        slowdown = result['median_ms'] - reference['median_ms']
+        if slowdown > reference['median_ms'] * tolerance and slowdown > min_slowdown_ms:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the matching and inference hot paths.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Synthetic dataset sizes for the matching cases.')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='New travellers (or tweets) timed per case.')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32, 128],
+                        help='predict_personality batch sizes.')
+    parser.add_argument('--n-tweets', type=int, default=256,
+                        help='Tweets per predict_personality call.')
+    parser.add_argument('--cases', nargs='+', default=None,
+                        help='Only run cases whose name contains one of these.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Number of torch CPU threads.')
+    parser.add_argument('--real-models', action='store_true',
+                        help='Use the real Hugging Face models instead of tiny '
+                             'random-weight stand-ins.')
+    parser.add_argument('--baseline', default=BASELINE_PATH,
+                        help='Baseline results to compare against.')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store these results as the new baseline.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed median slowdown against the baseline.')
+    parser.add_argument('--min-slowdown-ms', type=float, default=1.0,
+                        help='Slowdowns up to this many ms are never regressions.')
+    parser.add_argument('--score-cache', action='store_true',
+                        help='Keep the tweet score cache on (by default the '
+                             'models are timed on every call).')
+    args = parser.parse_args()
+
+    if not args.score_cache:
+        os.environ[SCORE_CACHE_ENV] = 'off'
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if not args.real_models:
+        from tiny_models import register_tiny_models
+        register_tiny_models(args.seed)
+
+    print(f'\n{"case":<52} {"median ms":>10} {"p90 ms":>10} {"p99 ms":>10} {"peak MB":>9}')
+    results = run_benchmarks(args.sizes, args.repeat, args.batch_sizes, args.n_tweets,
+                             args.cases, args.seed)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump({'environment': environment(),
+                       'models': 'real' if args.real_models else 'tiny',
+                       'results': results}, file, indent=2)
+        print(f'\nBaseline saved to {args.baseline}\n')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.tolerance, args.min_slowdown_ms)
+        if regressions:
+            print(f'\n{len(regressions)} case(s) slower than the baseline by more than '
+                  f'{args.tolerance:.0%}:', *regressions, sep='\n  ')
+            raise SystemExit(1)
+        print('\nNo regressions against the baseline.\n')
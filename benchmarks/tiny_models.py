@@ -0,0 +1,44 @@
+import os
+import string
+import tempfile
+import torch
+from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+from utils.interest_sentiment import SENTIMENT_LABELS
+from utils.model_registry import register_model
+from utils.psychology_sentiment import PERSONALITY_LABELS
+
+# Character-level WordPiece vocabulary, so any tweet tokenizes without downloads
+SPECIAL_TOKENS = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]']
+CHARACTERS = string.ascii_lowercase + string.digits + string.punctuation
+
+def build_tokenizer():
+    vocab = SPECIAL_TOKENS + list(CHARACTERS) + [f'##{char}' for char in CHARACTERS]
+    with tempfile.TemporaryDirectory() as directory:
+        vocab_path = os.path.join(directory, 'vocab.txt')
+        with open(vocab_path, 'w') as file:
+            file.write('\n'.join(vocab))
+        return BertTokenizerFast(vocab_path)
+
+def build_model(num_labels, vocab_size, seed=0):
+    # A 2-layer BERT with random weights: same code path, a fraction of the cost
+    torch.manual_seed(seed)
+    config = BertConfig(vocab_size=vocab_size,
+                        hidden_size=32,
+                        num_hidden_layers=2,
+                        num_attention_heads=2,
+                        intermediate_size=64,
+                        num_labels=num_labels)
+    return BertForSequenceClassification(config).eval()
+
+def register_tiny_models(seed=0):
+    """
+    Replace the sentiment and personality models with tiny random-weight
+    stand-ins, so the benchmarks run offline and measure the surrounding
+    code rather than the transformer.
+
+    """
+    for name, labels in [('sentiment', SENTIMENT_LABELS), ('personality', PERSONALITY_LABELS)]:
+        def loader(labels=labels):
+            tokenizer = build_tokenizer()
+            return tokenizer, build_model(len(labels), len(tokenizer), seed)
+        register_model(name, loader)
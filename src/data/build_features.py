@@ -0,0 +1,61 @@
+import argparse
+import time
+import pandas as pd
+from utils.cluster_model import (
+    CLUSTER_MODEL_DIR,
+    ClusterModel,
+    cluster_model_path,
+    load_cluster_model,
+    refit_cluster_model
+)
+from utils.feature_store import FEATURE_STORE_PATH, get_cluster_features, update_feature_store
+from utils.interest_sentiment import SENTIMENT_LABELS
+from utils.psychology_sentiment import PERSONALITY_LABELS
+
+CLUSTER_MODELS = {
+    'interest': SENTIMENT_LABELS,
+    'psychology': PERSONALITY_LABELS
+}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Build or update the tweet feature store.')
+    parser.add_argument('--data', default='./src/data/datasets/travelink_data_with_music.csv',
+                        help='Traveller dataset to score.')
+    parser.add_argument('--store', default=FEATURE_STORE_PATH,
+                        help='Parquet feature store to create or update.')
+    parser.add_argument('--models', default=CLUSTER_MODEL_DIR,
+                        help='Directory of the persisted cluster models.')
+    parser.add_argument('--refit', action='store_true',
+                        help='Fit the cluster models from scratch.')
+    parser.add_argument('--drift-threshold', type=float, default=0.1,
+                        help='Population drift above which the cluster models are refitted.')
+    args = parser.parse_args()
+
+    # Load the dataset
+    df = pd.read_csv(args.data)
+
+    # Score new or changed tweets only
+    start = time.perf_counter()
+    store, n_scored = update_feature_store(df, args.store)
+    elapsed = time.perf_counter() - start
+
+    print(f'\nScored {n_scored} of {len(df)} tweets in {elapsed:.1f}s.')
+    print(f'Feature store with {len(store)} trips saved to {args.store}')
+
+    # Fit new cluster models or refit drifted ones
+    for name, feature_columns in CLUSTER_MODELS.items():
+        features = get_cluster_features(name, df, store)
+        model = None if args.refit else load_cluster_model(name, args.models)
+        if model is None:
+            refitted = ClusterModel(feature_columns).fit(features)
+        else:
+            refitted = refit_cluster_model(model, features, args.drift_threshold)
+
+        if refitted is model:
+            print(f'{name} cluster model v{model.version} is up to date.')
+        else:
+            refitted.save(cluster_model_path(name, args.models))
+            print(f'{name} cluster model v{refitted.version} fitted on {refitted.n_samples} trips.')
+    print()
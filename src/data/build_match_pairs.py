@@ -0,0 +1,25 @@
+import argparse
+import time
+from utils.batch_matching import write_basic_matches
+from utils.dataset import DATASET_CSV_PATH, DATASET_PATH, load_dataset
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Match all travellers against each other.')
+    parser.add_argument('--data', default=DATASET_PATH, help='Parquet traveller dataset.')
+    parser.add_argument('--csv', default=DATASET_CSV_PATH, help='CSV used if the Parquet file is stale.')
+    parser.add_argument('--out', default='./src/data/datasets/travelink_match_pairs.parquet',
+                        help='Parquet file to write the match pairs to.')
+    parser.add_argument('--both-directions', action='store_true',
+                        help='Write every pair twice, once per traveller.')
+    args = parser.parse_args()
+
+    df = load_dataset(args.data, args.csv)
+
+    start = time.perf_counter()
+    n_pairs = write_basic_matches(df, args.out, args.both_directions)
+    elapsed = time.perf_counter() - start
+
+    print(f'\nFound {n_pairs} match pairs among {len(df)} trips in {elapsed:.2f}s.')
+    print(f'Saved to {args.out}\n')
@@ -0,0 +1,14 @@
+import argparse
+from utils.dataset import DATASET_CSV_PATH, DATASET_PATH, convert_dataset
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Convert the traveller CSV to typed Parquet.')
+    parser.add_argument('--csv', default=DATASET_CSV_PATH, help='Source CSV.')
+    parser.add_argument('--out', default=DATASET_PATH, help='Parquet file to write.')
+    args = parser.parse_args()
+
+    df = convert_dataset(args.csv, args.out)
+    memory = df.memory_usage(deep=True).sum() / 1e6
+    print(f'\nSaved {len(df)} trips ({memory:.2f} MB in memory) to {args.out}\n')
@@ -0,0 +1,17 @@
+import argparse
+import time
+from utils.model_registry import MODELS, save_model
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Save the models for offline use.')
+    parser.add_argument('--out', default='./models',
+                        help='Directory to save the models to.')
+    args = parser.parse_args()
+
+    for name in MODELS:
+        start = time.perf_counter()
+        path = save_model(name, args.out)
+        print(f'Saved {name} model ({time.perf_counter() - start:.1f}s) to {path}')
+    print(f'\nSet TRAVELINK_MODEL_DIR={args.out} to load them offline.\n')
@@ -0,0 +1,38 @@
+import argparse
+import time
+from utils.synthetic_data import write_dataset
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Generate a synthetic traveller dataset '
+                                                 'for load testing.')
+    parser.add_argument('--rows', type=int, default=100000, help='Number of travellers.')
+    parser.add_argument('--out', default='./src/data/datasets/travelink_synthetic.parquet',
+                        help='Output file, .parquet (typed) or .csv (original layout).')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    parser.add_argument('--chunk-size', type=int, default=100000,
+                        help='Rows generated and written at a time.')
+    parser.add_argument('--year', type=int, default=2024, help='First year of arrivals.')
+    parser.add_argument('--years', type=int, default=1,
+                        help='Number of years arrivals are spread over.')
+    parser.add_argument('--peak-day', type=int, default=196,
+                        help='Day of the year with the most arrivals.')
+    parser.add_argument('--seasonality', type=float, default=0.5,
+                        help='Strength of the seasonality, 0 for none.')
+    parser.add_argument('--city-skew', type=float, default=1.0,
+                        help='Zipf exponent of the arrival city popularity, 0 for uniform.')
+    parser.add_argument('--interest-share', type=float, default=0.3,
+                        help='Share of tweets mentioning an interest.')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    n_written = write_dataset(args.out, args.rows, args.chunk_size, args.seed,
+                              year=args.year,
+                              n_years=args.years,
+                              peak_day=args.peak_day,
+                              amplitude=args.seasonality,
+                              city_skew=args.city_skew,
+                              interest_share=args.interest_share)
+    elapsed = time.perf_counter() - start
+    print(f'\nGenerated {n_written} travellers in {elapsed:.1f}s, saved to {args.out}\n')
@@ -0,0 +1,54 @@
+import argparse
+import os
+import time
+from utils.scoring_pipeline import run_scoring_pipeline, write_feature_store, write_scored_output
+
+def report_chunk(chunk_id, n_tweets):
+    print(f'Scored chunk {chunk_id} ({n_tweets} tweets)', flush=True)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Score every tweet of a traveller CSV with the sentiment and '
+                    'personality models on a pool of processes.')
+    parser.add_argument('--input', default='./src/data/datasets/travelink_data_with_music.csv',
+                        help='Traveller CSV to score.')
+    parser.add_argument('--output', default='./src/data/datasets/travelink_data_scored.csv',
+                        help='CSV with the input columns and the model features.')
+    parser.add_argument('--checkpoints', default=None,
+                        help='Directory of the per-chunk checkpoints '
+                             '(defaults to <output>.chunks). Rerun to resume.')
+    parser.add_argument('--store', default=None,
+                        help='Also write a Parquet feature store to this path.')
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                        help='Rows per chunk.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Worker processes, each with its own copy of the models.')
+    parser.add_argument('--threads-per-worker', type=int, default=1,
+                        help='torch threads per worker.')
+    parser.add_argument('--batch-size', type=int, default=64,
+                        help='Tweets per forward pass.')
+    args = parser.parse_args()
+
+    checkpoint_dir = args.checkpoints or f'{args.output}.chunks'
+
+    start = time.perf_counter()
+    n_chunks, n_scored = run_scoring_pipeline(args.input,
+                                              checkpoint_dir,
+                                              chunk_size=args.chunk_size,
+                                              workers=args.workers,
+                                              threads_per_worker=args.threads_per_worker,
+                                              batch_size=args.batch_size,
+                                              on_chunk=report_chunk)
+    elapsed = time.perf_counter() - start
+    print(f'\nScored {n_scored} of {n_chunks} chunks in {elapsed:.1f}s '
+          f'({n_chunks - n_scored} resumed from {checkpoint_dir}).')
+
+    write_scored_output(checkpoint_dir, n_chunks, args.output)
+    print(f'Scored dataset saved to {args.output}')
+
+    if args.store:
+        store = write_feature_store(checkpoint_dir, n_chunks, args.store)
+        print(f'Feature store with {len(store)} trips saved to {args.store}')
+    print()
@@ -1,12 +1,9 @@
-import pandas as pd
 import streamlit as st
-from utils.utils import (
-    get_simultaneous_travellers,
-    get_basic_similar_travellers,
-    get_premium_interest_matching_travellers,
-    get_premium_psychology_matching_travellers
-)
+from utils.async_pipeline import match_concurrently
+from utils.engine import PLANS, MatchEngine
 from utils.get_spotify_data import main as get_spotify_genres
+from utils.instrumentation import metrics
+from utils.model_registry import get_load_times
 
 # Helper functions
 # ----------------
@@ -23,17 +20,34 @@ def newlines(amount):
 
 def get_music_genre():
     genres = get_spotify_genres()
-    return genres
+    return genres or []
 
 def get_club_n_pub():
     return 'None'
 
+def show_trace(request_trace):
+    # Stage breakdown of a traced request, nested stages indented
+    st.write(f'**{request_trace.name}**: {request_trace.seconds * 1e3:.1f} ms')
+    breakdown = request_trace.breakdown()
+    if breakdown:
+        st.dataframe([{'stage': '\u2003' * entry['depth'] + entry['stage'],
+                       'ms': round(entry['seconds'] * 1e3, 2),
+                       'calls': entry['calls']}
+                      for entry in breakdown])
+    if request_trace.counters:
+        st.write('Counters', request_trace.counters)
+
+@st.cache_resource
+def get_match_engine():
+    # One engine per process, shared by all sessions
+    return MatchEngine()
+
 # Load data
 # ---------
 
 cities = load_txt_data('./src/data/datasets/cities.txt')
 companies = load_txt_data('./src/data/datasets/companies.txt')
-all_travellers_df = pd.read_csv('./src/data/datasets/travelink_data_with_music.csv')
+match_engine = get_match_engine()
 
 # Sidebar
 # -------
@@ -41,12 +55,11 @@ all_travellers_df = pd.read_csv('./src/data/datasets/travelink_data_with_music.c
 st.sidebar.title('Settings')
 
 st.sidebar.header('Plan')
-plan = st.sidebar.selectbox('Your subscription plan:', ['Basic', 
-                                                        'Premium: Interest', 
-                                                        'Premium: Psychology'])
+plan = st.sidebar.selectbox('Your subscription plan:', PLANS)
 
 st.sidebar.header('Mode')
 developer_view = st.sidebar.checkbox("Developer view")
+profile_requests = developer_view and st.sidebar.checkbox('Profile requests')
 
 # Title and mission statement
 # -----------------------------
@@ -104,10 +117,8 @@ st.markdown('---')
 
 if submit_button:
     my_tweet = 'Really enjoyed that football match! #sports'
-    st.session_state['submitted'] = True
-    st.session_state['new_traveller'] = {
-        'Trip': 'None',
-        'ID': 'None' ,
+    new_traveller = {
+        'Trip ID': 'None',
         'Traveller Name': 'Me',
         'Arrival Date': arrival_date,
         'Return Date': return_date,
@@ -119,68 +130,36 @@ if submit_button:
         'free_time': free_time,
         'accommodation': 'None',
         'tweet': my_tweet,
-        'Music Genre': get_music_genre(),
+        'Music Genre': [],
         'Suggested Club/Pub': get_club_n_pub()
     }
+    # The Spotify lookup runs alongside the matching and tweet scoring
+    pipeline = match_concurrently(match_engine, new_traveller, plan, get_music_genre,
+                                  profile=profile_requests)
+    new_traveller['Music Genre'] = pipeline.genres
+    st.session_state['submitted'] = True
+    st.session_state['new_traveller'] = new_traveller
+    st.session_state['degraded'] = pipeline.degraded
 
 if 'submitted' in st.session_state and st.session_state['submitted']: 
 
-    # Get new traveller data
-    new_traveller = pd.DataFrame([st.session_state['new_traveller']])
-
-
-    # Get simultaneous travellers
-    simultaneous_travellers = get_simultaneous_travellers(all_travellers_df, 
-                                                          new_traveller.iloc[0])
-        
-    # Get similar travellers
-    if plan == 'Basic':
-        matching_travellers = get_basic_similar_travellers(simultaneous_travellers,
-                                                           new_traveller.iloc[0])
-        
-    elif plan == 'Premium: Interest':
-        # Basic
-        basic_matching_travellers = get_basic_similar_travellers(simultaneous_travellers,
-                                                                 new_traveller.iloc[0])
-        # Interest
-        interest_matching_travellers = get_premium_interest_matching_travellers(
-            all_travellers_df,
-            new_traveller
-        )
-        interest_matching_travellers = get_simultaneous_travellers(interest_matching_travellers,
-                                                                   new_traveller.iloc[0])
-        # Merge
-        matching_travellers = pd.concat([basic_matching_travellers,
-                                         interest_matching_travellers], ignore_index=True)
-        matching_travellers = matching_travellers.drop_duplicates()
-    
-    elif plan == 'Premium: Psychology':
-        # Basic
-        basic_matching_travellers = get_basic_similar_travellers(simultaneous_travellers,
-                                                                 new_traveller.iloc[0])
-        # Interest
-        psychology_matching_travellers = get_premium_psychology_matching_travellers(
-            all_travellers_df,
-            new_traveller
-        )
-        psychology_matching_travellers = get_simultaneous_travellers(psychology_matching_travellers,
-                                                                     new_traveller.iloc[0])
-        # Merge
-        matching_travellers = pd.concat([basic_matching_travellers,
-                                         psychology_matching_travellers], ignore_index=True)
-        matching_travellers = matching_travellers.drop_duplicates()
-        
+    # Get matching travellers and recommendations
+    if submit_button:
+        result = pipeline.result
+    else:
+        result = match_engine.match(st.session_state['new_traveller'], plan,
+                                    profile=profile_requests)
+    matching_travellers = result.travellers
     
     # Hotel recommendations
     # ---------------------
 
     st.header('Hotel recommendations')
-    hotels = ['Hilton Hotel', 'The Hotel', 'Ibis Hotel', 
-              'Elite Hotel', 'Novotel']
     
     if matching_travellers.empty:
+        # All hotels, most popular in the city during the trip first
         st.write(f'We recommend the following hotels:')
-        for hotel in hotels:
+        for hotel in result.hotels:
             col1, col2 = st.columns([4, 1])  # Adjust column width ratios as needed
             with col1:
                 st.write(f'- {hotel} {arrival_city}')
@@ -188,35 +167,24 @@ if 'submitted' in st.session_state and st.session_state['submitted']:
                 st.button('Book now', key=hotel)
     
     else:
-        # Count the occurrences of each accommodation and sort them by this count
-        accommodation_counts = matching_travellers['accommodation']\
-            .value_counts().reset_index()
-        accommodation_counts.columns = ['Accommodation', 'Count']
-        
-        # Sort accommodations by count in descending order
-        sorted_accommodations = accommodation_counts.sort_values(by='Count', ascending=False)
-
+        # Hotels ranked by how many matching travellers stay there
         st.write(f'Based on your specific preferences, we recommend any of the following hotels:')
-        for index, row in sorted_accommodations.iterrows():
+        for index, hotel in enumerate(result.hotels):
             col1, col2 = st.columns([4, 1])
             with col1:
-                st.write(f'&nbsp;&nbsp;{index + 1}. {str(row["Accommodation"])} {arrival_city}', 
+                st.write(f'&nbsp;&nbsp;{index + 1}. {hotel} {arrival_city}', 
                          unsafe_allow_html=True)
             with col2:
-                st.button('Book now', key=row["Accommodation"])
+                st.button('Book now', key=hotel)
 
         st.markdown('---')
 
         # Event recommendations
         # ---------------------
 
-        # Get clubs / pubs
-        clubs_n_pubs = matching_travellers['Suggested Club/Pub']
-        matching_clubs_n_pubs = [
-            club_pub for club_pub in clubs_n_pubs
-            if any(genre.lower() in club_pub.lower() for genre in get_music_genre())
-        ]
-        matching_clubs_n_pubs = list(set(matching_clubs_n_pubs))
+        # Clubs / pubs matching the genres looked up on submit,
+        # most matching genres first
+        matching_clubs_n_pubs = result.clubs
 
         if matching_clubs_n_pubs != []:
             st.header('Club & pub recommendations')
@@ -238,4 +206,16 @@ if 'submitted' in st.session_state and st.session_state['submitted']:
     if developer_view:
         st.header('Developer view')
         st.write('Matching travellers', matching_travellers)
+        st.write('Model load times (s)', get_load_times())
+        st.write('Result cache', match_engine.result_cache.stats())
+
+        st.subheader('Last request')
+        show_trace(result.trace)
+        if st.session_state.get('degraded'):
+            st.write('Skipped (timed out) on submit', st.session_state['degraded'])
+        if result.trace.profile:
+            with st.expander('Profile'):
+                st.code(result.trace.profile)
+        with st.expander('Metrics (all requests)'):
+            st.code(metrics.to_prometheus())
 
@@ -0,0 +1,228 @@
+import argparse
+import asyncio
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import tornado.web
+from utils.async_pipeline import match_async
+from utils.engine import PLANS, MatchEngine
+from utils.instrumentation import metrics
+from utils.result_cache import PROFILE_FIELDS
+from utils.sharding import RESULT_TIMEOUT, ShardRouter
+from utils.trip_index import DATE_FORMAT
+
+# Profile fields of a traveller that must be JSON strings
+STRING_FIELDS = ['Arrival City', 'company', 'mood', 'free_time', 'tweet']
+
+# Helper functions
+# ----------------
+
+def result_to_dict(result):
+    return {
+        'matches': json.loads(result.travellers.to_json(orient='records', date_format='iso')),
+        'hotels': result.hotels,
+        'clubs': result.clubs,
+        'trace': result.trace.to_dict() if result.trace else None
+    }
+
+def validate_traveller(traveller):
+    """
+    Check the profile fields of a traveller from a request: strings, a JSON
+    bool for networking, and dd/mm/YYYY dates with the arrival on or before
+    the return.
+
+    Raises
+    ------
+    ValueError:  Naming the first invalid field.
+
+    """
+    missing = [column for column in PROFILE_FIELDS if column not in traveller]
+    if missing:
+        raise ValueError(f'Traveller without {", ".join(missing)}')
+    for column in STRING_FIELDS:
+        if not isinstance(traveller[column], str):
+            raise ValueError(f'"{column}" must be a string')
+    if not isinstance(traveller['networking'], bool):
+        raise ValueError('"networking" must be true or false')
+    dates = {}
+    for column in ['Arrival Date', 'Return Date']:
+        try:
+            dates[column] = datetime.strptime(traveller[column], DATE_FORMAT)
+        except (TypeError, ValueError):
+            raise ValueError(f'"{column}" must be a dd/mm/YYYY date')
+    if dates['Arrival Date'] > dates['Return Date']:
+        raise ValueError('"Arrival Date" is after "Return Date"')
+
+def parse_request(body, field):
+    """
+    Parse a JSON request body holding `field` (a traveller dict, or a list of
+    them for 'travellers'), an optional plan and optional stage timeouts.
+
+    Raises
+    ------
+    ValueError:  If the body is not of that shape, a traveller is invalid
+                 (see validate_traveller) or the plan is unknown.
+
+    """
+    request = json.loads(body)
+    if not isinstance(request, dict):
+        raise ValueError('The body must be a JSON object')
+    if field not in request:
+        raise ValueError(f'Missing "{field}"')
+    value = request[field]
+    travellers = value if field == 'travellers' else [value]
+    if not isinstance(travellers, list) or not all(isinstance(traveller, dict)
+                                                   for traveller in travellers):
+        raise ValueError(f'"{field}" must be ' + ('a list of objects' if field == 'travellers'
+                                                 else 'an object'))
+    for traveller in travellers:
+        validate_traveller(traveller)
+    timeouts = request.get('timeouts')
+    if timeouts is not None and not (isinstance(timeouts, dict) and
+                                     all(isinstance(seconds, (int, float))
+                                         for seconds in timeouts.values())):
+        raise ValueError('"timeouts" must map stages to seconds')
+    plan = request.get('plan', 'Basic')
+    if plan not in PLANS:
+        raise ValueError(f'Unknown plan: {plan}')
+    return request, plan
+
+# HTTP front end
+# --------------
+
+class MatchHandler(tornado.web.RequestHandler):
+    """
+    POST {"traveller": {...}, "plan": "Basic"} to match one traveller, with
+    optional per-stage "timeouts" in seconds (see STAGE_TIMEOUTS).
+
+    """
+
+    def initialize(self, engine, executor):
+        self.engine = engine
+        self.executor = executor
+
+    async def post(self):
+        try:
+            request, plan = parse_request(self.request.body, 'traveller')
+        except ValueError as error:
+            raise tornado.web.HTTPError(400, reason=str(error))
+
+        if isinstance(self.engine, ShardRouter):
+            # Matched by the worker process of the arrival city
+            future = self.engine.submit_match(request['traveller'], plan, request.get('timeouts'))
+            try:
+                # Shielded, so a timeout doesn't cancel the router's Future
+                pipeline = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)),
+                                                  RESULT_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise tornado.web.HTTPError(504, reason='The shard did not answer in time')
+        else:
+            # The blocking stages run concurrently in the executor, keeping the
+            # event loop free for other requests
+            pipeline = await match_async(self.engine, request['traveller'], plan,
+                                         timeouts=request.get('timeouts'),
+                                         executor=self.executor)
+        self.write(dict(result_to_dict(pipeline.result), degraded=pipeline.degraded))
+
+class MatchManyHandler(MatchHandler):
+    """POST {"travellers": [...], "plan": "Basic"} to match travellers in one batch."""
+
+    async def post(self):
+        try:
+            request, plan = parse_request(self.request.body, 'travellers')
+        except ValueError as error:
+            raise tornado.web.HTTPError(400, reason=str(error))
+
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(self.executor, self.engine.match_many,
+                                             request['travellers'], plan)
+        self.write({'results': [result_to_dict(result) for result in results]})
+
+class HealthHandler(tornado.web.RequestHandler):
+
+    def initialize(self, engine):
+        self.engine = engine
+
+    async def get(self):
+        if isinstance(self.engine, ShardRouter):
+            loop = asyncio.get_running_loop()
+            shards = await loop.run_in_executor(None, self.engine.stats)
+            self.write({'status': 'ok', 'shards': shards})
+        else:
+            self.write({'status': 'ok', 'cache': self.engine.result_cache.stats()})
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Stage timings and counters, as Prometheus text or ?format=json."""
+
+    def get(self):
+        if self.get_argument('format', 'prometheus') == 'json':
+            self.set_header('Content-Type', 'application/json')
+            self.write(metrics.to_json())
+        else:
+            self.set_header('Content-Type', 'text/plain; version=0.0.4')
+            self.write(metrics.to_prometheus())
+
+def make_app(engine, workers=4):
+    executor = ThreadPoolExecutor(max_workers=workers)
+    handler_args = {'engine': engine, 'executor': executor}
+    return tornado.web.Application([
+        (r'/match', MatchHandler, handler_args),
+        (r'/match_many', MatchManyHandler, handler_args),
+        (r'/health', HealthHandler, {'engine': engine}),
+        (r'/metrics', MetricsHandler),
+    ])
+
+async def serve(engine, port, workers):
+    app = make_app(engine, workers)
+    app.listen(port)
+    print(f'Serving TraveLink matching on http://localhost:{port}')
+    await asyncio.Event().wait()
+
+# Command line
+# ------------
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='TraveLink matching service.')
+    parser.add_argument('--psychology-mode', choices=['cluster', 'nearest'], default=None,
+                        help='Match Premium: Psychology by cluster or nearest personalities.')
+    parser.add_argument('--neighbours', type=int, default=10,
+                        help='Maximum nearest-personality matches.')
+    parser.add_argument('--premium-scope', choices=['local', 'global'], default=None,
+                        help='Assign only the simultaneous travellers (local) or the '
+                             'whole population (global) for the Premium plans.')
+    parser.add_argument('--shards', type=int, default=0,
+                        help='Partition the trips by arrival city across this many '
+                             'worker processes (0: match in this process).')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='Run the HTTP API.')
+    serve_parser.add_argument('--port', type=int, default=8000)
+    serve_parser.add_argument('--workers', type=int, default=4,
+                              help='Threads running matches concurrently.')
+
+    match_parser = subparsers.add_parser('match', help='Match travellers from a JSON file.')
+    match_parser.add_argument('file', help='JSON with a "travellers" list (or "-" for stdin).')
+    match_parser.add_argument('--plan', choices=PLANS, default='Basic')
+
+    args = parser.parse_args()
+    engine_options = {'psychology_mode': args.psychology_mode,
+                      'n_neighbours': args.neighbours,
+                      'premium_scope': args.premium_scope}
+    if args.shards:
+        engine = ShardRouter(args.shards, **engine_options)
+    else:
+        engine = MatchEngine(**engine_options)
+
+    try:
+        if args.command == 'serve':
+            asyncio.run(serve(engine, args.port, args.workers))
+        else:
+            with (sys.stdin if args.file == '-' else open(args.file, 'r')) as file:
+                travellers = json.load(file)['travellers']
+            results = engine.match_many(travellers, args.plan)
+            print(json.dumps([result_to_dict(result) for result in results], indent=2))
+    finally:
+        if args.shards:
+            engine.close()
@@ -0,0 +1,148 @@
+import asyncio
+import contextvars
+import functools
+import logging
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from utils.engine import PLANS, MatchResult, score_features
+from utils.instrumentation import call_profiled, count, stage, trace
+
+logger = logging.getLogger(__name__)
+
+# Seconds from the start of a request after which it goes on without a stage:
+# without the genres (no club ranking by genre), or without the tweet's
+# model features (Basic matches only)
+STAGE_TIMEOUTS = {'genres': 2.0, 'scoring': 10.0}
+
+PipelineResult = namedtuple('PipelineResult', ['result', 'genres', 'degraded'])
+
+_executor = None
+
+def get_executor():
+    # Threads shared by all pipelines of the process
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='travelink-pipeline')
+    return _executor
+
+def run_blocking(executor, function, *args):
+    """
+    Run a blocking call in an executor. In threads it runs in a copy of the
+    current context, so its stages are recorded in the request's trace and,
+    if the request is profiled, it is profiled in its thread.
+
+    """
+    loop = asyncio.get_running_loop()
+    if isinstance(executor, ProcessPoolExecutor):
+        return loop.run_in_executor(executor, function, *args)
+    context = contextvars.copy_context()
+    return loop.run_in_executor(executor, functools.partial(context.run, call_profiled,
+                                                            function, *args))
+
+async def wait_stage(name, future, deadline):
+    """
+    Wait for a stage until deadline (event loop time).
+
+    Returns
+    -------
+    result:  The stage's result, None if it timed out or failed. The
+             blocking call itself is left to finish in the background.
+
+    """
+    timeout = max(deadline - asyncio.get_running_loop().time(), 0)
+    try:
+        with stage(f'wait_{name}'):
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+    except asyncio.TimeoutError:
+        logger.warning('Stage %s did not finish within its timeout', name)
+        count(f'{name}_timeouts')
+    except Exception as error:
+        logger.warning('Stage %s failed: %s', name, error)
+        count(f'{name}_errors')
+    return None
+
+async def match_async(engine, traveller, plan, get_genres=None, timeouts=None,
+                      profile=None, executor=None, scoring_executor=None):
+    """
+    Match a new traveller with the blocking stages running concurrently: the
+    genre lookup, the scoring of the tweet for the Premium plans and the
+    simultaneous/basic filters. The latency is close to the slowest stage
+    rather than the sum of all of them.
+
+    A stage that misses its timeout (see STAGE_TIMEOUTS) degrades the
+    result instead of failing it: without genres the clubs are not ranked
+    by genre, without the tweet's features the Basic matches are returned.
+
+    Arguments
+    ---------
+    engine (MatchEngine):   The matching engine.
+    traveller (dict):       The new traveller, see MatchEngine.match_travellers.
+    plan (str):             One of PLANS.
+    get_genres (callable):  Optional blocking genre lookup, e.g. Spotify. If
+                            not given, traveller['Music Genre'] is used.
+    timeouts (dict):        Seconds per stage, overriding STAGE_TIMEOUTS.
+    profile (bool):         Capture a cProfile of the request's blocking
+                            stages in the trace.
+    executor (Executor):    Threads for the blocking stages.
+    scoring_executor (Executor):  Executor (threads or processes) for the
+                            model scoring, defaults to executor.
+
+    Returns
+    -------
+    result (PipelineResult):  The MatchResult, the genres used and the list
+                              of degraded stages.
+
+    """
+    if plan not in PLANS:
+        raise ValueError(f'Unknown plan: {plan}')
+    timeouts = dict(STAGE_TIMEOUTS, **(timeouts or {}))
+    executor = executor or get_executor()
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    traveller = dict(traveller)
+    degraded = []
+
+    with trace(plan, profile, profile_caller=False) as request_trace:
+        # Start the slow lookups first, they run while the data is matched
+        genres_future = run_blocking(executor, get_genres) if get_genres else None
+        features_future = None
+        if plan != 'Basic':
+            features_future = run_blocking(scoring_executor or executor, score_features,
+                                           plan, [traveller['tweet']])
+
+        data = await run_blocking(executor, engine.reload_if_changed)
+        record = engine.new_traveller_record(traveller)
+        basic_future = run_blocking(executor, engine.match_record, data, record, 'Basic')
+
+        matching_travellers = None
+        if features_future is not None:
+            features = await wait_stage('scoring', features_future,
+                                        start + timeouts['scoring'])
+            if features is None:
+                degraded.append('scoring')
+            else:
+                labels, scores = features
+                traveller.update(zip(labels, scores[0]))
+                record = engine.new_traveller_record(traveller)
+                matching_travellers = await run_blocking(executor, engine.match_record,
+                                                         data, record, plan)
+        if matching_travellers is None:
+            matching_travellers = await basic_future
+
+        genres = traveller.get('Music Genre') or []
+        if genres_future is not None:
+            genres = await wait_stage('genres', genres_future, start + timeouts['genres'])
+            if genres is None:
+                degraded.append('genres')
+            genres = genres or []
+
+        hotels, clubs = call_profiled(engine.recommend, data, record,
+                                      'Basic' if 'scoring' in degraded else plan,
+                                      matching_travellers, genres)
+
+    result = MatchResult(matching_travellers, hotels, clubs, request_trace)
+    return PipelineResult(result, genres, degraded)
+
+def match_concurrently(engine, traveller, plan, get_genres=None, **options):
+    # Blocking entry point for callers without an event loop, e.g. Streamlit
+    return asyncio.run(match_async(engine, traveller, plan, get_genres, **options))
@@ -0,0 +1,94 @@
+import io
+import torch
+from transformers.modeling_outputs import SequenceClassifierOutput
+
+# fp32: the PyTorch model as loaded, int8: dynamically quantized Linear layers,
+# onnx: an exported graph run by onnxruntime (optional dependency)
+BACKENDS = ['fp32', 'int8', 'onnx']
+
+def quantize_model(model):
+    """
+    Quantize the Linear layers of a model to int8 weights with dynamically
+    quantized activations. Most of a transformer's compute and memory is in
+    these layers, so on CPU this cuts both.
+
+    """
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def export_onnx(tokenizer, model, opset_version=17):
+    # Trace the model into an ONNX graph with dynamic batch and sequence axes
+    inputs = tokenizer(['An example tweet'], return_tensors='pt')
+    input_names = list(inputs.keys())
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['logits'] = {0: 'batch'}
+    graph = io.BytesIO()
+    with torch.inference_mode():
+        torch.onnx.export(model, (dict(inputs),), graph,
+                          input_names=input_names,
+                          output_names=['logits'],
+                          dynamic_axes=dynamic_axes,
+                          opset_version=opset_version)
+    return graph.getvalue()
+
+class OnnxModel:
+    """
+    Runs an exported sequence classification graph with onnxruntime behind
+    the same call interface as the PyTorch model: model(**inputs).logits.
+
+    Arguments
+    ---------
+    graph (bytes):       The serialized ONNX graph.
+    num_threads (int):   Intra-op threads, defaults to torch's setting.
+
+    """
+
+    def __init__(self, graph, num_threads=None):
+        try:
+            import onnxruntime
+        except ImportError as error:
+            raise ImportError('The onnx inference backend needs onnxruntime: '
+                              'pip install onnxruntime') from error
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = num_threads or torch.get_num_threads()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(graph, options,
+                                                    providers=['CPUExecutionProvider'])
+        self.input_names = [node.name for node in self.session.get_inputs()]
+        self.graph_size = len(graph)
+
+    def __call__(self, **inputs):
+        feeds = {name: inputs[name].numpy() for name in self.input_names}
+        logits = self.session.run(['logits'], feeds)[0]
+        return SequenceClassifierOutput(logits=torch.from_numpy(logits))
+
+def convert_model(tokenizer, model, backend='fp32'):
+    """
+    Return model converted to an inference backend.
+
+    Arguments
+    ---------
+    tokenizer:       The model's tokenizer, used to trace the ONNX graph.
+    model:           A PyTorch sequence classification model in eval mode.
+    backend (str):   One of BACKENDS.
+
+    Returns
+    -------
+    model:  A model called as model(**inputs).logits.
+
+    """
+    if backend == 'fp32':
+        return model
+    if backend == 'int8':
+        return quantize_model(model)
+    if backend == 'onnx':
+        return OnnxModel(export_onnx(tokenizer, model))
+    raise ValueError(f'Unknown inference backend: {backend}. Choose from {BACKENDS}.')
+
+def model_size(model):
+    # Bytes of weights held by a model
+    if isinstance(model, OnnxModel):
+        return model.graph_size
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
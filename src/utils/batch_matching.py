@@ -0,0 +1,184 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from utils.trip_index import CityPartition, to_day_numbers
+
+# Matching pairs held in memory at a time by the streaming functions
+PAIRS_PER_CHUNK = 1000000
+
+def column_codes(column):
+    # Integer code per value, so equality joins compare integers
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.values
+    return pd.factorize(column)[0]
+
+def get_overlapping_pairs(partition, max_pairs=PAIRS_PER_CHUNK):
+    """
+    Sweep-line self join of a group of trips on date overlap.
+
+    Trips are sorted by arrival, so a trip overlaps every later-sorted trip
+    arriving on or before its return day, which is a contiguous run found
+    by binary search. Each unordered pair is produced once.
+
+    Arguments
+    ---------
+    partition (CityPartition):  The trips of one group, sorted by arrival.
+    max_pairs (int):            Pairs per yielded chunk, except for a trip
+                                overlapping more trips than that.
+
+    Yields
+    ------
+    left, right (ndarray):  Row positions of a chunk of overlapping pairs.
+
+    """
+    n = len(partition.arrivals)
+    ends = np.searchsorted(partition.arrivals, partition.returns, side='right')
+    counts = np.maximum(ends - np.arange(n) - 1, 0)
+    totals = np.cumsum(counts)
+
+    start = 0
+    while start < n:
+        done = totals[start - 1] if start else 0
+        stop = max(int(np.searchsorted(totals, done + max_pairs, side='right')), start + 1)
+        # Expand every trip i of the chunk into the positions i + 1, ..., ends[i] - 1
+        chunk_counts = counts[start:stop]
+        left = np.repeat(np.arange(start, stop), chunk_counts)
+        offsets = np.arange(len(left)) - np.repeat(np.cumsum(chunk_counts) - chunk_counts,
+                                                   chunk_counts)
+        right = left + 1 + offsets
+        yield partition.positions[left], partition.positions[right]
+        start = stop
+
+def iter_basic_matches(df, max_pairs=PAIRS_PER_CHUNK):
+    """
+    Find every pair of travellers that would match each other on the Basic
+    plan: same city, overlapping dates, same free time, mood and networking
+    preference, and a different company when networking (the same company
+    otherwise).
+
+    Trips are first grouped on the preferences they must share (and the
+    company when not networking), and only the trips of a group are swept
+    for overlapping dates, so the work and memory follow the number of
+    trips and matches rather than all overlapping pairs of a city.
+
+    Arguments
+    ---------
+    df (DataFrame):   The traveller data.
+    max_pairs (int):  About how many pairs each yielded frame holds.
+
+    Yields
+    ------
+    pairs (DataFrame):  A chunk of matching pairs, one row per pair with both
+                        Trip IDs, the city and the first and last day they
+                        overlap.
+
+    """
+    company = column_codes(df['company'])
+    networking = df['networking'].values.astype(bool)
+    keys = pd.DataFrame({
+        'city': column_codes(df['Arrival City']),
+        'free_time': column_codes(df['free_time']),
+        'mood': column_codes(df['mood']),
+        'networking': networking,
+        'company': np.where(networking, -1, company)
+    })
+    arrivals = to_day_numbers(df['Arrival Date'])
+    returns = to_day_numbers(df['Return Date'])
+    columns = pair_columns(df)
+
+    pieces, n_buffered = [], 0
+    for positions in keys.groupby(list(keys.columns), sort=False).indices.values():
+        if len(positions) < 2:
+            continue
+        group = CityPartition(positions, arrivals[positions], returns[positions])
+        for left, right in get_overlapping_pairs(group, max_pairs):
+            if networking[positions[0]]:
+                # Networking travellers match other companies only
+                different = company[left] != company[right]
+                left, right = left[different], right[different]
+            pieces.append((left, right))
+            n_buffered += len(left)
+            if n_buffered >= max_pairs:
+                yield pairs_frame(columns, *map(np.concatenate, zip(*pieces)))
+                pieces, n_buffered = [], 0
+    if pieces:
+        yield pairs_frame(columns, *map(np.concatenate, zip(*pieces)))
+
+def pair_columns(df):
+    # The columns of df the pairs are built from, as arrays
+    return {
+        'trip_ids': df['Trip ID'].values,
+        'cities': df['Arrival City'].astype(str).values,
+        'arrivals': df['Arrival Date'].values,
+        'returns': df['Return Date'].values
+    }
+
+def pairs_frame(columns, left, right):
+    # The pairs of row positions left and right as a frame of Trip IDs and overlaps
+    return pd.DataFrame({
+        'Trip ID': columns['trip_ids'][left],
+        'Matched Trip ID': columns['trip_ids'][right],
+        'Arrival City': columns['cities'][left],
+        'Overlap Start': np.maximum(columns['arrivals'][left], columns['arrivals'][right]),
+        'Overlap End': np.minimum(columns['returns'][left], columns['returns'][right])
+    })
+
+def empty_pairs(df):
+    no_rows = np.empty(0, dtype='int64')
+    return pairs_frame(pair_columns(df.iloc[:0]), no_rows, no_rows)
+
+def get_all_basic_matches(df):
+    """
+    Every matching pair of travellers on the Basic plan in one frame, see
+    iter_basic_matches.
+
+    """
+    chunks = list(iter_basic_matches(df))
+    if not chunks:
+        return empty_pairs(df)
+    return pd.concat(chunks, ignore_index=True)
+
+def reverse_pairs(pairs):
+    # The same pairs, seen from the matched traveller
+    return pairs.rename(columns={'Trip ID': 'Matched Trip ID',
+                                 'Matched Trip ID': 'Trip ID'})[pairs.columns]
+
+def write_basic_matches(df, path, both_directions=False, max_pairs=PAIRS_PER_CHUNK):
+    """
+    Stream every matching pair of travellers on the Basic plan to a Parquet
+    file, one row group per chunk, so the pairs are never all in memory.
+
+    Arguments
+    ---------
+    df (DataFrame):          The traveller data.
+    path (str):              Parquet file to write.
+    both_directions (bool):  Write every pair twice, once per traveller.
+    max_pairs (int):         About how many pairs are held in memory.
+
+    Returns
+    -------
+    n_pairs (int):  Number of rows written.
+
+    """
+    n_pairs = 0
+    writer = None
+    try:
+        for pairs in iter_basic_matches(df, max_pairs):
+            if both_directions:
+                pairs = pd.concat([pairs, reverse_pairs(pairs)], ignore_index=True)
+            table = pa.Table.from_pandas(pairs, preserve_index=False)
+            writer = writer or pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            n_pairs += len(pairs)
+        if writer is None:
+            empty_pairs(df).to_parquet(path, index=False)
+    finally:
+        if writer is not None:
+            writer.close()
+    return n_pairs
+
+def get_matches_by_traveller(pairs):
+    # Both directions of every pair, so each trip's matches are one lookup
+    return pd.concat([pairs, reverse_pairs(pairs)], ignore_index=True)\
+        .sort_values(['Trip ID', 'Matched Trip ID'], ignore_index=True)
@@ -0,0 +1,153 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+from utils.inference import score_texts
+from utils.instrumentation import count, profiling_request, stage
+from utils.model_registry import get_model
+
+# Largest coalesced batch (0 turns micro-batching off) and how long the
+# scheduler waits for more requests once it has one
+MAX_BATCH_SIZE_ENV = 'TRAVELINK_MAX_BATCH_SIZE'
+MAX_WAIT_MS_ENV = 'TRAVELINK_MAX_BATCH_WAIT_MS'
+
+class MicroBatcher:
+    """
+    Coalesces small scoring requests from concurrent callers (e.g. one per
+    Streamlit session) into batches scored in one call on a background
+    thread, and fans the results back out to the callers.
+
+    A batch is closed when it holds max_batch_size texts or max_wait_ms after
+    its first request, whichever comes first. A request is never split. When
+    there are no concurrent callers (the last batch had a single request and
+    nothing else is queued) a request is scored without waiting.
+
+    Arguments
+    ---------
+    score (callable):      score(texts) returns an array with one row per text.
+    max_batch_size (int):  Maximum number of texts per batch.
+    max_wait_ms (float):   Longest time a request waits for others.
+    name (str):            Name of the scheduler thread.
+
+    """
+
+    def __init__(self, score, max_batch_size=32, max_wait_ms=5, name='batcher'):
+        self.score = score
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self.queue = queue.Queue()
+        self.pending = None
+        self.last_batch_requests = 0
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+                self.thread.start()
+
+    def submit(self, texts):
+        # Queue texts for scoring, returns a Future of their rows
+        future = Future()
+        self.start()
+        self.queue.put((list(texts), future))
+        return future
+
+    def __call__(self, texts):
+        with stage('batch_wait'):
+            return self.submit(texts).result()
+
+    def next_batch(self):
+        # Block for a first request, then gather more until the batch is full or due
+        requests = [self.pending or self.queue.get()]
+        self.pending = None
+        size = len(requests[0][0])
+        concurrent = self.last_batch_requests > 1 or not self.queue.empty()
+        deadline = time.perf_counter() + (self.max_wait if concurrent else 0)
+        while size < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                request = (self.queue.get(timeout=timeout) if timeout > 0
+                           else self.queue.get_nowait())
+            except queue.Empty:
+                break
+            if size + len(request[0]) > self.max_batch_size:
+                # Starts the next batch
+                self.pending = request
+                break
+            requests.append(request)
+            size += len(request[0])
+        return requests
+
+    def run(self):
+        while True:
+            requests = [request for request in self.next_batch()
+                        if request[1].set_running_or_notify_cancel()]
+            if not requests:
+                continue
+            self.last_batch_requests = len(requests)
+            texts = [text for request_texts, _ in requests for text in request_texts]
+            try:
+                scores = self.score(texts)
+            except Exception as error:
+                for _, future in requests:
+                    future.set_exception(error)
+                continue
+
+            count('micro_batches')
+            count('micro_batched_requests', len(requests))
+            start = 0
+            for request_texts, future in requests:
+                future.set_result(scores[start:start + len(request_texts)])
+                start += len(request_texts)
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+def get_batcher(name):
+    """
+    Return the shared MicroBatcher of a registered model, configured by
+    TRAVELINK_MAX_BATCH_SIZE (default 32) and TRAVELINK_MAX_BATCH_WAIT_MS
+    (default 5), or None if micro-batching is off.
+
+    """
+    max_batch_size = int(os.environ.get(MAX_BATCH_SIZE_ENV, 32))
+    if max_batch_size <= 0:
+        return None
+    max_wait_ms = float(os.environ.get(MAX_WAIT_MS_ENV, 5))
+    with _batchers_lock:
+        batcher = _batchers.get(name)
+        if batcher is None or (batcher.max_batch_size, batcher.max_wait) != (max_batch_size,
+                                                                              max_wait_ms / 1000):
+            # The model is looked up per batch, so a re-registered model is used
+            batcher = _batchers[name] = MicroBatcher(
+                lambda texts: score_texts(*get_model(name), texts, batch_size=max_batch_size),
+                max_batch_size, max_wait_ms, name=f'travelink-{name}-batcher'
+            )
+        return batcher
+
+def score_model(name, texts, batch_size=32):
+    """
+    Score texts with a registered model. Requests smaller than a batch go
+    through the model's micro-batcher, so concurrent callers share forward
+    passes; larger ones are scored directly, as are profiled requests, so
+    the model shows up in their profile.
+
+    Returns
+    -------
+    probs (ndarray):  float32 array of shape (len(texts), num_labels).
+
+    """
+    texts = list(texts)
+    if not texts:
+        # Without loading the model
+        return np.empty((0, 0), dtype='float32')
+    batcher = get_batcher(name)
+    if (batcher is None or len(texts) >= batcher.max_batch_size
+            or profiling_request()):
+        return score_texts(*get_model(name), texts, batch_size=batch_size)
+    return np.asarray(batcher(texts))
@@ -0,0 +1,184 @@
+import copy
+import os
+import threading
+import time
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.preprocessing import StandardScaler
+from utils.instrumentation import stage
+
+CLUSTER_MODEL_DIR = './src/data/models'
+
+class ClusterModel:
+    """
+    A persisted StandardScaler + KMeans model used to assign travellers to
+    clusters with a single predict call instead of refitting per request.
+
+    Attributes
+    ----------
+    feature_columns (list):   Feature columns the model was fitted on.
+    version (int):            Incremented on every (partial) refit.
+    n_samples (int):          Population size at the last refit.
+    reference_mean (array):   Feature mean at the last refit, used for drift.
+    assignments (Series):     Cluster of each fitted trip, indexed by Trip ID.
+
+    """
+
+    def __init__(self, feature_columns, n_clusters=5, random_state=0):
+        self.feature_columns = list(feature_columns)
+        self.n_clusters = n_clusters
+        self.scaler = StandardScaler()
+        self.kmeans = MiniBatchKMeans(n_clusters=n_clusters,
+                                      random_state=random_state,
+                                      n_init=10)
+        self.version = 0
+        self.n_samples = 0
+        self.reference_mean = None
+        self.fitted_at = None
+        self.assignments = pd.Series(dtype='int32')
+
+    def _values(self, features):
+        return np.asarray(features[self.feature_columns], dtype='float64')
+
+    def fit(self, features):
+        values = self._values(features)
+        self.kmeans.fit(self.scaler.fit_transform(values))
+        self._refresh(values, features['Trip ID'])
+        return self
+
+    def partial_fit(self, features):
+        # Update the existing centroids with the current population, and the
+        # scaler with the trips it has not seen, so none is counted twice
+        values = self._values(features)
+        unseen = ~features['Trip ID'].isin(self.assignments.index).values
+        if unseen.any():
+            self.scaler.partial_fit(values[unseen])
+        self.kmeans.partial_fit(self.scaler.transform(values))
+        self._refresh(values, features['Trip ID'])
+        return self
+
+    def _refresh(self, values, trip_ids):
+        self.version += 1
+        self.n_samples = len(values)
+        self.reference_mean = values.mean(axis=0)
+        self.fitted_at = time.time()
+        self.assignments = pd.Series(self.predict_values(values),
+                                     index=pd.Index(trip_ids.values, name='Trip ID'))
+
+    def predict_values(self, values):
+        with stage('scaling'):
+            scaled = self.scaler.transform(values)
+        with stage('clustering'):
+            return self.kmeans.predict(scaled).astype('int32')
+
+    def predict(self, features):
+        return self.predict_values(self._values(features))
+
+    def drift(self, features):
+        """
+        Measure how far the population has moved since the last refit: the
+        largest feature mean shift in standard deviations, or the relative
+        change in population size, whichever is larger.
+
+        """
+        values = self._values(features)
+        mean_shift = np.abs(values.mean(axis=0) - self.reference_mean) / self.scaler.scale_
+        size_change = abs(len(values) - self.n_samples) / max(self.n_samples, 1)
+        return float(max(mean_shift.max(), size_change))
+
+    def needs_refit(self, features, threshold=0.1):
+        return self.drift(features) > threshold
+
+    def save(self, path):
+        # Write to a temporary file first so readers never see a partial model
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        joblib.dump(self, tmp_path)
+        os.replace(tmp_path, path)
+
+def cluster_model_path(name, directory=CLUSTER_MODEL_DIR):
+    return os.path.join(directory, f'{name}_clusters.joblib')
+
+_loaded_models = {}
+_refit_state = {}
+_lock = threading.Lock()
+
+def load_cluster_model(name, directory=CLUSTER_MODEL_DIR):
+    """
+    Load a persisted cluster model, reusing the in-memory copy until the
+    file on disk is replaced by a newer version.
+
+    Arguments
+    ---------
+    name (str):       Model name, e.g. 'interest' or 'psychology'.
+    directory (str):  Directory containing the persisted models.
+
+    Returns
+    -------
+    model (ClusterModel):  The model, or None if it has not been built yet.
+
+    """
+    path = cluster_model_path(name, directory)
+    if not os.path.exists(path):
+        return None
+    mtime = os.path.getmtime(path)
+    with _lock:
+        cached = _loaded_models.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, joblib.load(path))
+            _loaded_models[path] = cached
+    return cached[1]
+
+def refit_cluster_model(model, features, threshold=0.1):
+    """
+    Return a refitted copy of model if the population drifted past threshold,
+    otherwise the model itself. The original model is never modified, so
+    requests keep seeing stable clusters while a refit is running.
+
+    Arguments
+    ---------
+    model (ClusterModel):   The current model.
+    features (DataFrame):   Current population features with a 'Trip ID' column.
+    threshold (float):      Drift above which the model is refitted.
+
+    """
+    if not model.needs_refit(features, threshold):
+        return model
+    return copy.deepcopy(model).partial_fit(features)
+
+def refit_in_background(name, get_features, threshold=0.1,
+                        check_interval=600, directory=CLUSTER_MODEL_DIR):
+    """
+    Check the named model for drift at most every check_interval seconds and,
+    if needed, refit and persist it on a background thread. get_features is
+    called on that thread and returns the current population features.
+
+    Returns
+    -------
+    thread (Thread):  The refit thread, or None if no refit was started.
+
+    """
+    model = load_cluster_model(name, directory)
+    if model is None:
+        return None
+
+    now = time.time()
+    with _lock:
+        state = _refit_state.setdefault(name, {'checked_at': 0.0, 'thread': None})
+        running = state['thread'] is not None and state['thread'].is_alive()
+        if running or now - state['checked_at'] < check_interval:
+            return None
+        state['checked_at'] = now
+
+    def refit():
+        refitted = refit_cluster_model(model, get_features(), threshold)
+        if refitted is not model:
+            refitted.save(cluster_model_path(name, directory))
+
+    thread = threading.Thread(target=refit, name=f'refit-{name}', daemon=True)
+    with _lock:
+        state['thread'] = thread
+    thread.start()
+    return thread
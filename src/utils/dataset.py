@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from utils.instrumentation import stage
+from utils.trip_index import parse_dates
+
+DATASET_CSV_PATH = './src/data/datasets/travelink_data_with_music.csv'
+DATASET_PATH = './src/data/datasets/travelink_data_with_music.parquet'
+
+DATE_COLUMNS = ['Arrival Date', 'Return Date']
+CATEGORICAL_COLUMNS = ['Departure City', 'Arrival City', 'company', 'mood',
+                       'free_time', 'accommodation', 'Music Genre',
+                       'Suggested Club/Pub']
+
+# Parquet metadata key of the size and hash of the CSV a dataset was converted from
+SOURCE_METADATA_KEY = b'travelink_source'
+
+_csv_hashes = {}
+_csv_hashes_lock = threading.Lock()
+
+def read_csv_dataset(csv_path=DATASET_CSV_PATH):
+    """
+    Read the traveller CSV with proper dtypes: datetime dates, categorical
+    text fields and a boolean networking flag.
+
+    """
+    with stage('load_csv'):
+        df = pd.read_csv(csv_path)
+    for column in DATE_COLUMNS:
+        df[column] = parse_dates(df[column])
+    for column in CATEGORICAL_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype('category')
+    df['networking'] = df['networking'].astype(bool)
+    return df
+
+def csv_source(csv_path=DATASET_CSV_PATH):
+    """
+    Identify the contents of the CSV by its size and SHA-256. The hash is
+    reused while the file's modification time and size don't change.
+
+    """
+    stat = os.stat(csv_path)
+    key = (os.path.abspath(csv_path), stat.st_mtime_ns, stat.st_size)
+    with _csv_hashes_lock:
+        digest = _csv_hashes.get(key)
+    if digest is None:
+        sha256 = hashlib.sha256()
+        with open(csv_path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                sha256.update(block)
+        digest = sha256.hexdigest()
+        with _csv_hashes_lock:
+            _csv_hashes[key] = digest
+    return {'size': stat.st_size, 'sha256': digest}
+
+def convert_dataset(csv_path=DATASET_CSV_PATH, path=DATASET_PATH):
+    # Write the typed dataset as Parquet, which keeps the dtypes, tagged with its source CSV
+    source = csv_source(csv_path)
+    df = read_csv_dataset(csv_path)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[SOURCE_METADATA_KEY] = json.dumps(source)
+    pq.write_table(table.replace_schema_metadata(metadata), path)
+    return df
+
+def parquet_is_current(path=DATASET_PATH, csv_path=DATASET_CSV_PATH):
+    """
+    Whether the Parquet dataset exists and was converted from the CSV as it
+    is now, going by the size and hash stored in its metadata (modification
+    times change on checkout and copies, and miss edits within a second).
+
+    """
+    if not os.path.exists(path):
+        return False
+    if not os.path.exists(csv_path):
+        return True
+    stored = (pq.read_schema(path).metadata or {}).get(SOURCE_METADATA_KEY)
+    if stored is None:
+        return False
+    source = json.loads(stored)
+    # Compare the sizes first, so a changed CSV is usually not hashed
+    return source['size'] == os.path.getsize(csv_path) and source == csv_source(csv_path)
+
+def city_filter(cities=None, exclude_cities=None):
+    # Parquet filter keeping the trips to cities, or to any city not in exclude_cities
+    if cities is not None:
+        return [('Arrival City', 'in', list(cities))]
+    if exclude_cities is not None:
+        return [('Arrival City', 'not in', list(exclude_cities))]
+    return None
+
+def load_dataset(path=DATASET_PATH, csv_path=DATASET_CSV_PATH, cities=None,
+                 exclude_cities=None):
+    """
+    Load the typed traveller dataset from Parquet (memory-mapped), falling
+    back to the CSV if the Parquet file is missing or was converted from a
+    different version of the CSV.
+
+    Arguments
+    ---------
+    path (str):             The Parquet dataset written by convert_dataset.
+    csv_path (str):         The source CSV.
+    cities (list):          Only load the trips to these arrival cities.
+    exclude_cities (list):  Only load the trips to other arrival cities.
+
+    Returns
+    -------
+    df (DataFrame):  Traveller data with datetime and categorical columns.
+
+    """
+    if parquet_is_current(path, csv_path):
+        with stage('load_parquet'):
+            return pd.read_parquet(path, memory_map=True,
+                                   filters=city_filter(cities, exclude_cities))
+    df = read_csv_dataset(csv_path)
+    if cities is not None:
+        df = df[df['Arrival City'].isin(cities)].reset_index(drop=True)
+    elif exclude_cities is not None:
+        df = df[~df['Arrival City'].isin(exclude_cities)].reset_index(drop=True)
+    return df
+
+def load_city_counts(path=DATASET_PATH, csv_path=DATASET_CSV_PATH):
+    # Number of trips per arrival city, reading only that column
+    if parquet_is_current(path, csv_path):
+        cities = pd.read_parquet(path, columns=['Arrival City'])['Arrival City']
+    else:
+        cities = pd.read_csv(csv_path, usecols=['Arrival City'])['Arrival City']
+    return cities.astype(str).value_counts().to_dict()
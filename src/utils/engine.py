@@ -0,0 +1,317 @@
+import copy
+import os
+import threading
+from collections import namedtuple
+import pandas as pd
+from utils.cluster_model import CLUSTER_MODEL_DIR, cluster_model_path, load_cluster_model, refit_in_background
+from utils.dataset import DATASET_CSV_PATH, DATASET_PATH, load_dataset
+from utils.feature_store import FEATURE_STORE_PATH, get_cluster_features, load_feature_store
+from utils.hotel_aggregates import HotelAggregates, changed_trips
+from utils.instrumentation import stage, trace
+from utils.interest_sentiment import SENTIMENT_LABELS, get_sentiments
+from utils.keyword_matcher import KeywordMatcher
+from utils.neighbours import PersonalityIndex
+from utils.psychology_sentiment import PERSONALITY_LABELS, predict_personality
+from utils.records import EncodedTravellers, TravellerRecord
+from utils.result_cache import MatchResultCache, data_version, make_cache_key
+from utils.trip_index import TripIndex
+from utils.utils import get_matching_travellers
+
+PLANS = ['Basic', 'Premium: Interest', 'Premium: Psychology']
+HOTELS = ['Hilton Hotel', 'The Hotel', 'Ibis Hotel', 'Elite Hotel', 'Novotel']
+CLUSTER_MODEL_NAMES = ['interest', 'psychology']
+
+# 'cluster' (default) or 'nearest' matching for the Premium: Psychology plan
+PSYCHOLOGY_MODE_ENV = 'TRAVELINK_PSYCHOLOGY_MODE'
+
+# 'local' (default) or 'global' Premium matching, see get_matching_travellers
+PREMIUM_SCOPE_ENV = 'TRAVELINK_PREMIUM_SCOPE'
+
+# Defaults for the fields a new traveller does not provide
+TRAVELLER_DEFAULTS = {
+    'Trip ID': 'None',
+    'Traveller Name': 'Me',
+    'Departure City': 'None',
+    'accommodation': 'None',
+    'Music Genre': [],
+    'Suggested Club/Pub': 'None'
+}
+
+MatchResult = namedtuple('MatchResult', ['travellers', 'hotels', 'clubs', 'trace'],
+                         defaults=[None])
+
+# Everything loaded for one data version, swapped as a whole on reload
+EngineData = namedtuple('EngineData', ['travellers', 'trip_index', 'encoded', 'feature_store',
+                                       'cluster_models', 'personality_index', 'hotel_aggregates'])
+
+# Share of changed trips up to which a reload updates the hotel aggregates
+# instead of rebuilding them
+MAX_INCREMENTAL_CHANGES = 0.1
+
+def hotel_order(hotel):
+    # Position in HOTELS, used to break ties; other hotels come last
+    return HOTELS.index(hotel) if hotel in HOTELS else len(HOTELS)
+
+def rank_hotels(matching_travellers):
+    """
+    Rank the hotels the matching travellers stay at by number of travellers,
+    falling back to the default hotel list when nobody matched.
+
+    """
+    if matching_travellers.empty:
+        return list(HOTELS)
+    counts = matching_travellers['accommodation'].value_counts()
+    counts = counts[counts > 0]
+    return sorted((str(hotel) for hotel in counts.index),
+                  key=lambda hotel: (-counts[hotel], hotel_order(hotel)))
+
+def score_features(plan, tweets):
+    """
+    Score the tweets of new travellers with the model of a plan.
+
+    Returns
+    -------
+    labels (list):      The feature names, empty for the Basic plan.
+    scores (ndarray):   One row of features per tweet.
+
+    """
+    if plan == 'Premium: Interest':
+        return SENTIMENT_LABELS, get_sentiments(tweets)
+    if plan == 'Premium: Psychology':
+        return PERSONALITY_LABELS, pd.DataFrame(predict_personality(tweets),
+                                                columns=PERSONALITY_LABELS).values
+    return [], []
+
+@stage('rank_clubs')
+def rank_clubs(matching_travellers, genres):
+    # Clubs/pubs of matching travellers that fit the genres, best first
+    return KeywordMatcher(genres or []).rank(matching_travellers['Suggested Club/Pub'])
+
+class MatchEngine:
+    """
+    Loads the traveller data, index, features and cluster models once and
+    matches new travellers against them. Safe to share between threads;
+    the data is reloaded when the files on disk change.
+
+    Arguments
+    ---------
+    dataset_path (str):        Typed Parquet dataset.
+    csv_path (str):            Source CSV, used if the Parquet file is stale.
+    feature_store_path (str):  Precomputed tweet features.
+    model_dir (str):           Directory of the persisted cluster models.
+    result_cache (MatchResultCache):  Optional shared result cache.
+    psychology_mode (str):     'cluster' or 'nearest' (top n_neighbours
+                               personalities among the simultaneous travellers,
+                               needs the feature store). Defaults to
+                               TRAVELINK_PSYCHOLOGY_MODE or 'cluster'.
+    n_neighbours (int):        Maximum number of nearest-neighbour matches.
+    premium_scope (str):       'local' (only the simultaneous travellers are
+                               assigned with the cluster models) or 'global'.
+                               Defaults to TRAVELINK_PREMIUM_SCOPE or 'local'.
+    cities (list):             Only load the trips to these arrival cities
+                               (and their features), e.g. for a shard.
+    exclude_cities (list):     Only load the trips to other arrival cities.
+    refit (bool):              Refit drifted cluster models in the background.
+                               Needs the whole population, so shards don't.
+
+    """
+
+    def __init__(self, dataset_path=DATASET_PATH, csv_path=DATASET_CSV_PATH,
+                 feature_store_path=FEATURE_STORE_PATH, model_dir=CLUSTER_MODEL_DIR,
+                 result_cache=None, psychology_mode=None, n_neighbours=10,
+                 premium_scope=None, cities=None, exclude_cities=None, refit=True):
+        self.dataset_path = dataset_path
+        self.csv_path = csv_path
+        self.feature_store_path = feature_store_path
+        self.model_dir = model_dir
+        self.result_cache = result_cache or MatchResultCache()
+        self.psychology_mode = psychology_mode or os.environ.get(PSYCHOLOGY_MODE_ENV, 'cluster')
+        self.n_neighbours = n_neighbours
+        self.premium_scope = premium_scope or os.environ.get(PREMIUM_SCOPE_ENV, 'local')
+        self.cities = cities
+        self.exclude_cities = exclude_cities
+        self.refit = refit
+        self.lock = threading.Lock()
+        self.version = None
+        self.data = None
+        self.reload_if_changed()
+
+    def data_version(self):
+        return data_version(self.dataset_path, self.csv_path, self.feature_store_path,
+                            *[cluster_model_path(name, self.model_dir)
+                              for name in CLUSTER_MODEL_NAMES])
+
+    def reload_if_changed(self):
+        version = self.data_version()
+        with self.lock:
+            if version != self.version:
+                travellers = load_dataset(self.dataset_path, self.csv_path,
+                                          self.cities, self.exclude_cities)
+                feature_store = load_feature_store(self.feature_store_path)
+                if self.cities is not None or self.exclude_cities is not None:
+                    feature_store = feature_store[feature_store.index.isin(travellers['Trip ID'])]
+                self.data = EngineData(
+                    travellers,
+                    TripIndex(travellers),
+                    EncodedTravellers(travellers),
+                    feature_store,
+                    {name: self.assign_new_trips(name, load_cluster_model(name, self.model_dir),
+                                                 travellers, feature_store)
+                     for name in CLUSTER_MODEL_NAMES},
+                    self.build_personality_index(feature_store),
+                    self.build_hotel_aggregates(travellers)
+                )
+                self.result_cache.set_version(version)
+                self.version = version
+            data = self.data
+
+        # Refit drifted cluster models in the background (checked at most every 10 min)
+        for name in CLUSTER_MODEL_NAMES if self.refit else []:
+            refit_in_background(name,
+                                lambda name=name: get_cluster_features(name,
+                                                                       data.travellers,
+                                                                       data.feature_store),
+                                directory=self.model_dir)
+        return data
+
+    def assign_new_trips(self, name, model, travellers, feature_store):
+        """
+        Return a copy of a persisted cluster model whose assignments also
+        cover the trips added since it was fitted, predicted from their
+        stored features, so they match in the global scope before the next
+        refit. The shared model itself is left as it is.
+
+        """
+        if model is None:
+            return None
+        new_trips = travellers[~travellers['Trip ID'].isin(model.assignments.index) &
+                               travellers['Trip ID'].isin(feature_store.index)]
+        if new_trips.empty:
+            return model
+        with stage('assign_new_trips'):
+            features = get_cluster_features(name, new_trips, feature_store)
+            if features.empty:
+                return model
+            assigned = copy.copy(model)
+            assigned.assignments = pd.concat([
+                model.assignments,
+                pd.Series(model.predict(features),
+                          index=pd.Index(features['Trip ID'].values, name='Trip ID'))
+            ])
+        return assigned
+
+    def build_personality_index(self, feature_store):
+        if self.psychology_mode != 'nearest' or feature_store.empty:
+            return None
+        features = feature_store[PERSONALITY_LABELS].reset_index()
+        return PersonalityIndex(features, PERSONALITY_LABELS)
+
+    def build_hotel_aggregates(self, travellers):
+        """
+        Apply the trips added, removed or changed since the last data version
+        to a copy of its hotel aggregates (sharing the unchanged buckets), or
+        build them if most trips changed.
+
+        """
+        with stage('hotel_aggregates'):
+            if self.data is not None:
+                removed, added = changed_trips(self.data.travellers, travellers)
+                if len(removed) + len(added) <= MAX_INCREMENTAL_CHANGES * len(travellers):
+                    return self.data.hotel_aggregates.updated(removed, added)
+            return HotelAggregates(travellers, HOTELS)
+
+    def new_traveller_record(self, traveller):
+        return TravellerRecord.from_dict(dict(TRAVELLER_DEFAULTS, **traveller))
+
+    def match_travellers(self, traveller, plan):
+        """
+        Return the travellers matching a new traveller under a plan.
+
+        Arguments
+        ---------
+        traveller (dict):  The new traveller's 'Arrival City', 'Arrival Date',
+                           'Return Date' (dd/mm/YYYY or dates), 'company',
+                           'networking', 'mood', 'free_time' and 'tweet'.
+        plan (str):        One of PLANS.
+
+        Returns
+        -------
+        matching_travellers (DataFrame):  The matching travellers.
+
+        """
+        if plan not in PLANS:
+            raise ValueError(f'Unknown plan: {plan}')
+        data = self.reload_if_changed()
+        return self.match_record(data, self.new_traveller_record(traveller), plan)
+
+    def match_record(self, data, record, plan):
+        # Cached matching of a TravellerRecord against one data version
+        cache_key = make_cache_key(record.to_dict(), plan)
+        return self.result_cache.get_or_compute(
+            cache_key,
+            lambda: get_matching_travellers(data.travellers,
+                                            record.to_frame(data.travellers.columns),
+                                            plan,
+                                            data.trip_index,
+                                            data.feature_store,
+                                            data.cluster_models,
+                                            data.personality_index,
+                                            self.n_neighbours,
+                                            self.premium_scope,
+                                            data.encoded)
+        )
+
+    def match(self, traveller, plan, profile=None):
+        """
+        Match a new traveller and build the recommendations.
+
+        Arguments
+        ---------
+        traveller (dict):  The new traveller, see match_travellers.
+        plan (str):        One of PLANS.
+        profile (bool):    Capture a cProfile of the request in the trace.
+                           Defaults to TRAVELINK_PROFILE.
+
+        Returns
+        -------
+        result (MatchResult):  The matching travellers, the ranked hotels (or
+                               all hotels by popularity in the city when nobody
+                               matched), the ranked clubs/pubs for the
+                               traveller's genres and the request's Trace of
+                               stage timings.
+
+        """
+        if plan not in PLANS:
+            raise ValueError(f'Unknown plan: {plan}')
+        with trace(plan, profile) as request_trace:
+            data = self.reload_if_changed()
+            record = self.new_traveller_record(traveller)
+            matching_travellers = self.match_record(data, record, plan)
+            hotels, clubs = self.recommend(data, record, plan, matching_travellers,
+                                           traveller.get('Music Genre'))
+        return MatchResult(matching_travellers, hotels, clubs, request_trace)
+
+    def recommend(self, data, record, plan, matching_travellers, genres):
+        # Ranked hotels and clubs/pubs for the matching travellers
+        with stage('rank_hotels'):
+            if matching_travellers.empty:
+                hotels = data.hotel_aggregates.popular(record)
+            elif plan == 'Basic':
+                # Range sums over the aggregates, same ranking as rank_hotels
+                hotels = data.hotel_aggregates.rank(record)
+            else:
+                hotels = rank_hotels(matching_travellers)
+        clubs = rank_clubs(matching_travellers, genres)
+        return hotels, clubs
+
+    def match_many(self, travellers, plan):
+        """
+        Match several new travellers. For the Premium plans all their tweets
+        are scored in one batch up front instead of one forward pass each.
+
+        """
+        travellers = [dict(traveller) for traveller in travellers]
+        labels, scores = score_features(plan, [traveller['tweet'] for traveller in travellers])
+        for traveller, features in zip(travellers, scores):
+            traveller.update(zip(labels, features))
+        return [self.match(traveller, plan) for traveller in travellers]
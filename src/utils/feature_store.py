@@ -0,0 +1,113 @@
+import hashlib
+import os
+import pandas as pd
+from utils.interest_sentiment import SENTIMENT_LABELS, INTERESTS, get_sentiments, process_data
+from utils.psychology_sentiment import PERSONALITY_LABELS, predict_personality, extract_features
+
+FEATURE_STORE_PATH = './src/data/datasets/travelink_features.parquet'
+FEATURE_COLUMNS = SENTIMENT_LABELS + PERSONALITY_LABELS
+
+def tweet_hash(tweet):
+    return hashlib.sha1(str(tweet).encode('utf-8')).hexdigest()
+
+def empty_feature_store():
+    store = pd.DataFrame(columns=['tweet_hash'] + FEATURE_COLUMNS)
+    store[FEATURE_COLUMNS] = store[FEATURE_COLUMNS].astype('float32')
+    store.index.name = 'Trip ID'
+    return store
+
+def load_feature_store(path=FEATURE_STORE_PATH):
+    """
+    Load the precomputed tweet features, indexed by Trip ID.
+
+    Arguments
+    ---------
+    path (str):  Location of the Parquet feature store.
+
+    Returns
+    -------
+    store (DataFrame):  One row per trip with the tweet hash, the sentiment
+                        probabilities and the Big-Five traits. Empty if the
+                        store has not been built yet.
+
+    """
+    if not os.path.exists(path):
+        return empty_feature_store()
+    return pd.read_parquet(path, memory_map=True)
+
+def score_tweets(tweets, batch_size=32):
+    # Score a list of tweets with both models
+    features = pd.DataFrame(get_sentiments(tweets, batch_size=batch_size),
+                            columns=SENTIMENT_LABELS)
+    personality = pd.DataFrame(predict_personality(tweets, batch_size=batch_size),
+                               columns=PERSONALITY_LABELS)
+    features[PERSONALITY_LABELS] = personality
+    return features.astype('float32')
+
+def update_feature_store(df, path=FEATURE_STORE_PATH):
+    """
+    Score new or changed tweets of df and persist them in the feature store.
+    Rows whose tweet hash already matches the store are not rescored, and
+    trips that no longer exist in df are dropped.
+
+    Arguments
+    ---------
+    df (DataFrame):  Traveller data with 'Trip ID' and 'tweet' columns.
+    path (str):      Location of the Parquet feature store.
+
+    Returns
+    -------
+    store (DataFrame):   The updated feature store.
+    n_scored (int):      Number of tweets that had to be scored.
+
+    """
+    store = load_feature_store(path)
+    trips = df[['Trip ID', 'tweet']].set_index('Trip ID')
+    hashes = trips['tweet'].map(tweet_hash)
+
+    # Keep only the trips still in the dataset, then find stale entries
+    store = store[store.index.isin(trips.index)]
+    known_hashes = store['tweet_hash'].reindex(trips.index)
+    stale = known_hashes != hashes
+
+    if stale.any():
+        tweets = trips.loc[stale, 'tweet'].tolist()
+        scored = score_tweets(tweets)
+        scored.insert(0, 'tweet_hash', hashes[stale].values)
+        scored.index = pd.Index(trips.index[stale], name='Trip ID')
+        store = pd.concat([store.drop(index=scored.index, errors='ignore'),
+                           scored])
+
+    store = store.sort_index()
+    store.to_parquet(path)
+    return store, int(stale.sum())
+
+def attach_features(df, store, columns):
+    """
+    Join stored features onto df by Trip ID. Trips missing from the store
+    (e.g. a new traveller) get NaN features so they are scored on the fly.
+
+    """
+    return df.join(store[columns], on='Trip ID')
+
+def get_cluster_features(name, df, store):
+    """
+    Population features used to fit the named cluster model: sentiment of
+    interest-mentioning tweets for 'interest', Big-Five traits for
+    'psychology'. Features missing from the store are scored on the fly.
+
+    Returns
+    -------
+    features (DataFrame):  Feature columns plus the 'Trip ID' of each row.
+
+    """
+    travellers = attach_features(df, store, FEATURE_COLUMNS)
+    if name == 'interest':
+        features = process_data(travellers, INTERESTS)[SENTIMENT_LABELS]
+        trip_ids = df.loc[features.index, 'Trip ID'].values
+    else:
+        features = extract_features(travellers)
+        trip_ids = df['Trip ID'].values
+    features = features.reset_index(drop=True)
+    features.insert(0, 'Trip ID', trip_ids)
+    return features
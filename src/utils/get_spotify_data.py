@@ -1,12 +1,41 @@
+import hashlib
+import logging
+import os
+import threading
 import requests
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from utils.instrumentation import count, stage
 
-def get_top_artists(access_token):
-    top_artists_url = 'https://api.spotify.com/v1/me/top/artists'
+logger = logging.getLogger(__name__)
+
+TOKEN_PATH = 'src/utils/keys/token.key'
+TOP_ARTISTS_URL = 'https://api.spotify.com/v1/me/top/artists'
+
+# 'spotify' (default) or 'stub', which returns TRAVELINK_STUB_GENRES
+GENRE_BACKEND_ENV = 'TRAVELINK_GENRE_BACKEND'
+STUB_GENRES_ENV = 'TRAVELINK_STUB_GENRES'
+
+def create_session(retries=3, backoff_factor=0.3, pool_size=10):
+    # Pooled session that retries transient failures
+    retry = Retry(total=retries, backoff_factor=backoff_factor,
+                  status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=['GET'])
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size,
+                          pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    return session
+
+def get_top_artists(access_token, session=None, timeout=5):
     headers = {
         'Authorization': f'Bearer {access_token}',
         'Content-Type': 'application/json',
     }
-    response = requests.get(top_artists_url, headers=headers)
+    response = (session or requests).get(TOP_ARTISTS_URL, headers=headers,
+                                         timeout=timeout)
+    response.raise_for_status()
     return response.json()
 
 def extract_top_genres(top_artists):
@@ -21,17 +50,98 @@ def extract_top_genres(top_artists):
     sorted_genres = sorted(genre_count.items(), key=lambda x: x[1], reverse=True)
     return [genre[0] for genre in sorted_genres][:5]  # Top 5 genres
 
+class SpotifyBackend:
+    """Looks up the top genres of a user through the Spotify Web API."""
+
+    def __init__(self, session=None, timeout=5):
+        self.session = session or create_session()
+        self.timeout = timeout
+
+    def top_genres(self, access_token):
+        top_artists = get_top_artists(access_token, self.session, self.timeout)
+        return extract_top_genres(top_artists)
+
+class StubBackend:
+    """Returns fixed genres, for running without Spotify."""
+
+    def __init__(self, genres):
+        self.genres = list(genres)
+
+    def top_genres(self, access_token):
+        return list(self.genres)
+
+class GenreProvider:
+    """
+    Caches the top genres per access token for ttl seconds in front of a
+    backend. Failed lookups return an empty list and are not cached.
+
+    Arguments
+    ---------
+    backend:         Object with a top_genres(access_token) method.
+    ttl (int):       Seconds a token's genres are reused.
+    maxsize (int):   Maximum number of cached tokens.
+
+    """
+
+    def __init__(self, backend, ttl=3600, maxsize=1024):
+        self.backend = backend
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.lock = threading.Lock()
+
+    def get_genres(self, access_token):
+        # Key by token hash so raw tokens are not kept in memory
+        key = hashlib.sha256(access_token.encode('utf-8')).hexdigest()
+        with self.lock:
+            genres = self.cache.get(key)
+        if genres is not None:
+            count('genre_cache_hits')
+            return list(genres)
+
+        try:
+            with stage('spotify'):
+                genres = self.backend.top_genres(access_token)
+        except requests.RequestException as error:
+            logger.warning('Genre lookup failed: %s', error)
+            count('spotify_errors')
+            return []
+
+        with self.lock:
+            self.cache[key] = genres
+        return list(genres)
+
+_provider = None
+_provider_lock = threading.Lock()
+
+def get_genre_provider():
+    # Process-wide provider, the backend is picked from the environment
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            if os.environ.get(GENRE_BACKEND_ENV) == 'stub':
+                genres = os.environ.get(STUB_GENRES_ENV, 'Pop,Rock').split(',')
+                backend = StubBackend([genre.strip() for genre in genres])
+            else:
+                backend = SpotifyBackend()
+            _provider = GenreProvider(backend)
+    return _provider
+
+def read_token(path=TOKEN_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as file:
+        return file.read().strip()
+
 def main():
-    with open('src/utils/keys/token.key', 'r') as file:
-        access_token = file.read()
-    
+    access_token = read_token()
+    if os.environ.get(GENRE_BACKEND_ENV) == 'stub':
+        access_token = access_token or 'stub'
+
     top_genres = None
     if access_token:
-        top_artists = get_top_artists(access_token)
-        top_genres = extract_top_genres(top_artists)
-    
+        top_genres = get_genre_provider().get_genres(access_token)
+
     return top_genres
-   
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
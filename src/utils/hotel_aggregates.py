@@ -0,0 +1,268 @@
+import numpy as np
+from utils.trip_index import to_day_numbers
+
+# Preferences a Basic match must share; the company is handled separately
+BUCKET_COLUMNS = ['Arrival City', 'mood', 'free_time', 'networking']
+
+# Columns the aggregates depend on
+AGGREGATE_COLUMNS = ['Trip ID', 'Arrival Date', 'Return Date', 'company',
+                     'accommodation'] + BUCKET_COLUMNS
+
+# Changes kept unmerged per DayCounts before they are merged into its arrays
+MAX_DELTA = 32
+
+def changed_trips(old, new):
+    """
+    Compare two versions of the traveller data on AGGREGATE_COLUMNS.
+
+    Returns
+    -------
+    removed (DataFrame):  Trips of old that are not in new (or changed).
+    added (DataFrame):    Trips of new that are not in old (or changed).
+
+    """
+    old = old[AGGREGATE_COLUMNS].astype({column: object for column in AGGREGATE_COLUMNS[3:]})
+    new = new[AGGREGATE_COLUMNS].astype({column: object for column in AGGREGATE_COLUMNS[3:]})
+    merged = old.merge(new, how='outer', on=AGGREGATE_COLUMNS, indicator=True)
+    return (merged[merged['_merge'] == 'left_only'][AGGREGATE_COLUMNS],
+            merged[merged['_merge'] == 'right_only'][AGGREGATE_COLUMNS])
+
+class DayCounts:
+    """
+    Hotel counts of trips by day: the sorted distinct days trips fall on,
+    with the cumulative count per hotel up to each, so "how many per hotel
+    up to day d" is a binary search. Recent changes are kept in a small
+    delta and merged in once it grows past MAX_DELTA.
+
+    Immutable, so versions of HotelAggregates can share it; updates return
+    a new DayCounts.
+
+    Arguments
+    ---------
+    days (ndarray):        Sorted distinct day numbers.
+    cumulative (ndarray):  int32 array of shape (len(days) + 1, n_hotels),
+                           row i holds the counts of days[:i].
+    delta (tuple):         Unmerged changes, arrays of days, hotel codes and
+                           signs (+1 or -1).
+
+    """
+    __slots__ = ('days', 'cumulative', 'delta')
+
+    def __init__(self, days, cumulative, delta=None):
+        self.days = days
+        self.cumulative = cumulative
+        self.delta = delta
+
+    @classmethod
+    def build(cls, days, hotels, signs, n_hotels):
+        # Counts of the trips falling on days (one entry per trip), compressed to distinct days
+        distinct, inverse = np.unique(days, return_inverse=True)
+        counts = np.zeros((len(distinct), n_hotels), dtype='int32')
+        np.add.at(counts, (inverse, hotels), signs)
+        kept = counts.any(axis=1)
+        cumulative = np.zeros((kept.sum() + 1, n_hotels), dtype='int32')
+        np.cumsum(counts[kept], axis=0, out=cumulative[1:])
+        return cls(distinct[kept], cumulative)
+
+    def updated(self, days, hotels, signs, n_hotels):
+        # Copy with the changes added to the delta, merged if it grew too large
+        if self.delta is not None:
+            days, hotels, signs = (np.concatenate(arrays) for arrays in
+                                   zip(self.delta, (days, hotels, signs)))
+        if len(days) <= MAX_DELTA:
+            return DayCounts(self.days, self.cumulative, (days, hotels, signs))
+        # Per-day counts of the merged arrays, followed by the changes
+        width = self.cumulative.shape[1]
+        base = np.diff(self.cumulative, axis=0)
+        base_days = np.repeat(self.days, width)
+        base_hotels = np.tile(np.arange(width), len(self.days))
+        return DayCounts.build(np.concatenate([base_days, days]),
+                               np.concatenate([base_hotels, hotels]),
+                               np.concatenate([base.ravel(), signs]), n_hotels)
+
+    def prefix(self, day, n_hotels):
+        # Counts summed over the days up to day
+        counts = np.zeros(n_hotels, dtype='int64')
+        row = self.cumulative[np.searchsorted(self.days, day, side='right')]
+        counts[:len(row)] = row
+        if self.delta is not None:
+            days, hotels, signs = self.delta
+            before = days <= day
+            np.add.at(counts, hotels[before], signs[before])
+        return counts
+
+    def total(self, n_hotels):
+        # Counts over all days
+        counts = np.zeros(n_hotels, dtype='int64')
+        counts[:self.cumulative.shape[1]] = self.cumulative[-1]
+        if self.delta is not None:
+            np.add.at(counts, self.delta[1], self.delta[2])
+        return counts
+
+class HotelAggregates:
+    """
+    Hotel counts of the stored trips, aggregated so that ranking the hotels of
+    a traveller's Basic matches is a range sum over day buckets instead of a
+    filter and group-by over rows.
+
+    Trips overlapping [start, end] are those arriving by end minus those
+    returning before start, so each (city, mood, free_time, networking)
+    bucket keeps DayCounts of hotel counts by arrival and by return day.
+    The same company condition is applied with the (few) trips of the
+    traveller's company in the bucket. Counts per city (any preferences)
+    order the fallback hotels by popularity.
+
+    Arguments
+    ---------
+    df (DataFrame):  Traveller data.
+    hotels (list):   Known hotels, in their default order. Hotels found in df
+                     are added.
+
+    """
+
+    def __init__(self, df, hotels=()):
+        self.hotels = list(hotels)
+        self.hotel_index = {hotel: index for index, hotel in enumerate(self.hotels)}
+        self.buckets = {}
+        self.city_buckets = {}
+        self.company_trips = {}
+        self.add_trips(df)
+
+    # Updates
+    # -------
+
+    def updated(self, removed, added):
+        """
+        Copy with trips removed and added, e.g. the changes of a reload. The
+        copy shares the buckets that did not change with this one, which is
+        left as it is for the requests still using it.
+
+        """
+        aggregates = HotelAggregates.__new__(HotelAggregates)
+        aggregates.hotels = list(self.hotels)
+        aggregates.hotel_index = dict(self.hotel_index)
+        aggregates.buckets = dict(self.buckets)
+        aggregates.city_buckets = dict(self.city_buckets)
+        aggregates.company_trips = dict(self.company_trips)
+        aggregates.remove_trips(removed)
+        aggregates.add_trips(added)
+        return aggregates
+
+    def add_trips(self, df):
+        self.update(df, 1)
+
+    def remove_trips(self, df):
+        self.update(df, -1)
+
+    def update(self, df, sign):
+        # Add (sign=1) or remove (sign=-1) the trips of df, replacing the touched buckets
+        if df.empty:
+            return
+        arrivals = to_day_numbers(df['Arrival Date'])
+        returns = to_day_numbers(df['Return Date'])
+        hotels = self.hotel_codes(df['accommodation'])
+        signs = np.full(len(df), sign, dtype='int32')
+
+        keys = df[BUCKET_COLUMNS].astype(object).itertuples(index=False, name=None)
+        companies = df['company'].astype(object).values
+        groups = {}
+        for position, key in enumerate(keys):
+            groups.setdefault(key, []).append(position)
+
+        cities = {}
+        for key, positions in groups.items():
+            positions = np.array(positions)
+            cities.setdefault(key[0], []).append(positions)
+            self.update_counts(self.buckets, key, arrivals[positions], returns[positions],
+                               hotels[positions], signs[positions])
+            for position in positions:
+                self.update_company(key + (companies[position],), arrivals[position],
+                                    returns[position], hotels[position], sign)
+        for city, positions in cities.items():
+            positions = np.concatenate(positions)
+            self.update_counts(self.city_buckets, city, arrivals[positions], returns[positions],
+                               hotels[positions], signs[positions])
+
+    def update_counts(self, buckets, key, arrivals, returns, hotels, signs):
+        counts = buckets.get(key)
+        n_hotels = len(self.hotels)
+        if counts is None:
+            buckets[key] = (DayCounts.build(arrivals, hotels, signs, n_hotels),
+                            DayCounts.build(returns, hotels, signs, n_hotels))
+        else:
+            buckets[key] = (counts[0].updated(arrivals, hotels, signs, n_hotels),
+                            counts[1].updated(returns, hotels, signs, n_hotels))
+
+    def update_company(self, key, arrival, return_day, hotel, sign):
+        # Trips per (bucket, company), small enough to scan
+        trips = self.company_trips.get(key, ())
+        trip = (int(arrival), int(return_day), int(hotel))
+        if sign > 0:
+            self.company_trips[key] = trips + (trip,)
+        elif trip in trips:
+            position = trips.index(trip)
+            trips = trips[:position] + trips[position + 1:]
+            if trips:
+                self.company_trips[key] = trips
+            else:
+                del self.company_trips[key]
+
+    def hotel_codes(self, accommodation):
+        for hotel in accommodation.astype(object).unique():
+            if hotel not in self.hotel_index:
+                self.hotel_index[hotel] = len(self.hotels)
+                self.hotels.append(hotel)
+        return np.array([self.hotel_index[hotel] for hotel in accommodation.astype(object)],
+                        dtype='int64')
+
+    # Queries
+    # -------
+
+    def overlap_counts(self, counts, start, end):
+        # Hotel counts of the trips overlapping days [start, end]
+        n_hotels = len(self.hotels)
+        if counts is None:
+            return np.zeros(n_hotels, dtype='int64')
+        return counts[0].prefix(end, n_hotels) - counts[1].prefix(start - 1, n_hotels)
+
+    def basic_counts(self, record):
+        """
+        Hotel counts of the trips matching record (a TravellerRecord) on the
+        Basic plan.
+
+        """
+        key = (record.arrival_city, record.mood, record.free_time, record.networking)
+        start, end = record.arrival_day, record.return_day
+        company_counts = np.zeros(len(self.hotels), dtype='int64')
+        for arrival, return_day, hotel in self.company_trips.get(key + (record.company,), ()):
+            if arrival <= end and return_day >= start:
+                company_counts[hotel] += 1
+        if not record.networking:
+            return company_counts
+        return self.overlap_counts(self.buckets.get(key), start, end) - company_counts
+
+    def rank(self, record):
+        """
+        Hotels of the traveller's Basic matches, most matches first.
+
+        Returns
+        -------
+        hotels (list):  Hotels with at least one match.
+
+        """
+        counts = self.basic_counts(record)
+        order = np.argsort(-counts, kind='stable')
+        return [self.hotels[index] for index in order if counts[index] > 0]
+
+    def popular(self, record):
+        """
+        Every hotel, ordered by how many trips to the traveller's city overlap
+        their dates, then by all trips to the city.
+
+        """
+        counts = self.city_buckets.get(record.arrival_city)
+        overlapping = self.overlap_counts(counts, record.arrival_day, record.return_day)
+        totals = (counts[0].total(len(self.hotels)) if counts is not None
+                  else np.zeros(len(self.hotels), dtype='int64'))
+        order = np.lexsort((-totals, -overlapping))
+        return [self.hotels[index] for index in order]
@@ -0,0 +1,80 @@
+import threading
+import weakref
+import numpy as np
+import torch
+from utils.instrumentation import count, stage
+
+# Tokenizer locks
+# ---------------
+
+# One lock per tokenizer instance, dropped with the tokenizer
+_tokenizer_locks = weakref.WeakKeyDictionary()
+_locks_guard = threading.Lock()
+
+def get_tokenizer_lock(tokenizer):
+    """
+    Return the lock serializing calls to a tokenizer. The model registry
+    shares one tokenizer per model between request threads, micro-batchers
+    and background refits, and a fast (Rust) tokenizer sets its truncation
+    and padding options on every call, so concurrent calls to it fail with
+    'Already borrowed'.
+
+    """
+    with _locks_guard:
+        return _tokenizer_locks.setdefault(tokenizer, threading.Lock())
+
+# Scoring
+# -------
+
+def score_texts(tokenizer, model, texts, batch_size=32, max_length=512):
+    """
+    Run a sequence classification model over texts in batches and return
+    the softmax probabilities.
+
+    The texts are tokenized once, then sorted by token length, so each
+    batch is padded only to the length of its longest member. The forward
+    passes run under torch.inference_mode(), so no autograd graph is
+    recorded. They use torch's thread count, set once per process (see
+    utils.model_registry).
+
+    Arguments
+    ---------
+    tokenizer:           A Hugging Face tokenizer.
+    model:               A sequence classification model returning logits.
+    texts (list):        The texts to score.
+    batch_size (int):    Number of texts per forward pass.
+    max_length (int):    Token limit per text, longer texts are truncated.
+
+    Returns
+    -------
+    probs (ndarray):  float32 array of shape (len(texts), num_labels),
+                      in the order of texts.
+
+    """
+    texts = [str(text) for text in texts]
+    if not texts:
+        return np.empty((0, 0), dtype='float32')
+
+    with stage('tokenize'), get_tokenizer_lock(tokenizer):
+        encodings = tokenizer(texts, truncation=True, max_length=max_length)
+    lengths = [len(ids) for ids in encodings['input_ids']]
+    order = np.argsort(lengths, kind='stable')
+
+    probs = None
+    with torch.inference_mode():
+        for start in range(0, len(texts), batch_size):
+            batch = order[start:start + batch_size]
+            with stage('tokenize'):
+                # Padding the encoded texts doesn't call the (locked) tokenizer backend
+                inputs = tokenizer.pad([{key: values[i] for key, values in encodings.items()}
+                                        for i in batch], return_tensors='pt')
+            with stage('model_forward'):
+                logits = model(**inputs).logits
+            if probs is None:
+                probs = np.empty((len(texts), logits.shape[-1]), dtype='float32')
+            probs[batch] = torch.softmax(logits.float(), dim=-1).numpy()
+            count('model_batches')
+
+    count('texts_scored', len(texts))
+
+    return probs
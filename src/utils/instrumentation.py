@@ -0,0 +1,252 @@
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+# Set to 1 to capture a cProfile of every traced request
+PROFILE_ENV = 'TRAVELINK_PROFILE'
+
+_current_trace = contextvars.ContextVar('travelink_trace', default=None)
+
+# Nesting depth of the current stage. A context variable, so stages running
+# concurrently in executor threads nest under the stage that started them
+_current_depth = contextvars.ContextVar('travelink_trace_depth', default=0)
+
+class Trace:
+    """
+    Timings and counters of one request, e.g. one match. Stages may nest;
+    each recorded stage keeps its nesting depth. Stages, counters and
+    profiles may be added from several threads.
+
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = []
+        self.counters = {}
+        self.seconds = None
+        self.profile = None
+        self.profiling = False
+        self.profilers = []
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # Picklable (e.g. returned by a shard worker) without the lock and pending profiles
+        state = dict(self.__dict__)
+        del state['lock']
+        state['profilers'] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def add_stage(self, entry):
+        with self.lock:
+            self.stages.append(entry)
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_profile(self, profiler):
+        # Profiles finished after the request (e.g. a timed out stage) are dropped
+        with self.lock:
+            if self.seconds is None:
+                self.profilers.append(profiler)
+
+    def finish(self, seconds):
+        # Merge the profiles of all threads that ran the request
+        with self.lock:
+            self.seconds = seconds
+            profilers, self.profilers = self.profilers, []
+        if profilers:
+            self.profile = format_profile(*profilers)
+
+    def breakdown(self):
+        # Total seconds and calls per stage, in order of first use
+        totals = {}
+        with self.lock:
+            stages = list(self.stages)
+        for entry in stages:
+            total = totals.setdefault(entry['stage'], {'stage': entry['stage'],
+                                                       'depth': entry['depth'],
+                                                       'seconds': 0.0,
+                                                       'calls': 0})
+            total['seconds'] += entry['seconds']
+            total['calls'] += 1
+        return list(totals.values())
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'seconds': self.seconds,
+            'stages': self.breakdown(),
+            'counters': dict(self.counters)
+        }
+
+class Metrics:
+    """
+    Process-wide stage timings and counters, aggregated over all requests
+    and background work, exportable as JSON or Prometheus text.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            total = self.stages.setdefault(stage, {'count': 0, 'sum': 0.0, 'max': 0.0})
+            total['count'] += 1
+            total['sum'] += seconds
+            total['max'] = max(total['max'], seconds)
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self.lock:
+            return {'stages': {stage: dict(total) for stage, total in self.stages.items()},
+                    'counters': dict(self.counters)}
+
+    def reset(self):
+        with self.lock:
+            self.stages.clear()
+            self.counters.clear()
+
+    def to_json(self):
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self, prefix='travelink'):
+        snapshot = self.snapshot()
+        lines = [f'# HELP {prefix}_stage_seconds Time spent per pipeline stage.',
+                 f'# TYPE {prefix}_stage_seconds summary']
+        for stage, total in sorted(snapshot['stages'].items()):
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {total["sum"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {total["count"]}')
+        lines += [f'# HELP {prefix}_stage_seconds_max Slowest call per pipeline stage.',
+                  f'# TYPE {prefix}_stage_seconds_max gauge']
+        for stage, total in sorted(snapshot['stages'].items()):
+            lines.append(f'{prefix}_stage_seconds_max{{stage="{stage}"}} {total["max"]:.6f}')
+        lines += [f'# HELP {prefix}_events_total Pipeline event counters.',
+                  f'# TYPE {prefix}_events_total counter']
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f'{prefix}_events_total{{event="{name}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+@contextmanager
+def stage(name):
+    """
+    Time a pipeline stage. The time is added to the process-wide metrics
+    and, inside a trace, to the current request's trace. Also usable as a
+    function decorator.
+
+    """
+    current = _current_trace.get()
+    if current is not None:
+        # Recorded on entry, so stages are listed in the order they started
+        depth = _current_depth.get()
+        entry = {'stage': name, 'seconds': 0.0, 'depth': depth}
+        current.add_stage(entry)
+        token = _current_depth.set(depth + 1)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        metrics.observe(name, seconds)
+        if current is not None:
+            _current_depth.reset(token)
+            entry['seconds'] = seconds
+
+def count(name, value=1):
+    # Increment a counter in the process-wide metrics and the current trace
+    metrics.increment(name, value)
+    current = _current_trace.get()
+    if current is not None:
+        current.increment(name, value)
+
+def profiling_enabled():
+    return os.environ.get(PROFILE_ENV, '') not in ('', '0')
+
+@contextmanager
+def trace(name, profile=None, profile_caller=True):
+    """
+    Collect the stage timings and counters of one request into a Trace.
+
+    Arguments
+    ---------
+    name (str):             Name of the request, e.g. the plan.
+    profile (bool):         Also capture a cProfile of the request, summarized
+                            in trace.profile. Defaults to TRAVELINK_PROFILE.
+    profile_caller (bool):  Profile the calling thread. Asynchronous callers,
+                            whose thread only waits on an event loop, turn it
+                            off and profile their blocking calls with
+                            call_profiled instead.
+
+    Returns
+    -------
+    trace (Trace):  Filled in when the block exits.
+
+    """
+    request_trace = Trace(name)
+    token = _current_trace.set(request_trace)
+    depth_token = _current_depth.set(0)
+    profiler = None
+    if profile if profile is not None else profiling_enabled():
+        request_trace.profiling = True
+        if profile_caller:
+            profiler = cProfile.Profile()
+            profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield request_trace
+    finally:
+        seconds = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+            request_trace.add_profile(profiler)
+        request_trace.finish(seconds)
+        _current_depth.reset(depth_token)
+        _current_trace.reset(token)
+
+def profiling_request():
+    # Whether the current request is profiled
+    current = _current_trace.get()
+    return current is not None and current.profiling
+
+def call_profiled(function, *args):
+    """
+    Call a function, e.g. in an executor thread, under a profiler of its own
+    if the current trace is profiled. Its profile is merged into the trace's
+    when the trace ends.
+
+    """
+    current = _current_trace.get()
+    if current is None or not current.profiling:
+        return function(*args)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return function(*args)
+    finally:
+        profiler.disable()
+        current.add_profile(profiler)
+
+def format_profile(*profilers, limit=30):
+    # The slowest functions by cumulative time over all profilers, as text
+    output = io.StringIO()
+    stats = pstats.Stats(*profilers, stream=output)
+    stats.sort_stats('cumulative').print_stats(limit)
+    return output.getvalue()
@@ -1,44 +1,80 @@
+from functools import lru_cache
+import numpy as np
 import pandas as pd
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-from scipy.special import softmax
 from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
+from utils.batching import score_model
+from utils.instrumentation import stage
+from utils.keyword_matcher import KeywordMatcher
+from utils.model_registry import model_version
+from utils.score_cache import cached_scores
+
+SENTIMENT_LABELS = ['negative', 'neutral', 'positive']
+
+INTERESTS = {
+    "gardening": ["gardening", "planting", "landscaping"],
+    "cuisine": ["cuisine", "cooking", "culinary arts", "gastronomy"],
+    "museums": ["museums", "exhibitions", "art galleries", "cultural centres"],
+    "walking": ["walking", "strolling", "treading"],
+    "parks": ["parks", "public gardens", "recreational areas"],
+    "hiking": ["hiking", "trekking", "trail hiking"],
+    "outdoors": ["park", "garden", "trail", "hiking", "walking", "strolling", "trekking", "outdoor", "nature"],
+    "leisure": ["museum", "theatre", "cinema", "concert", "gallery", "exhibit", "show", "event"],
+    "sports": ["sports", "soccer", "tennis", "basketball", "football", "baseball", "golf", "fitness", "gym"],
+    "travel": ["travel", "vacation", "trip", "expedition", "cruise", "tour", "journey"],
+    "food": ["cuisine", "cooking", "eating", "dining", "foodie", "gastronomy", "culinary"]
+}
 
 def load_data(filepath):
     return pd.read_csv(filepath)
 
-tokenizer = AutoTokenizer.from_pretrained("cardiffnlp/twitter-roberta-base-sentiment")
-model = AutoModelForSequenceClassification.from_pretrained("cardiffnlp/twitter-roberta-base-sentiment")
+def get_sentiments(tweets, batch_size=32):
+    # Batched scoring of the tweets not in the score cache, returns an array
+    # of probabilities in SENTIMENT_LABELS order
+    return cached_scores('sentiment', model_version('sentiment'), tweets,
+                         lambda texts: score_model('sentiment', texts,
+                                                   batch_size=batch_size))
 
 def get_sentiment(tweet):
-    inputs = tokenizer(tweet, return_tensors="pt", truncation=True, max_length=512)
-    outputs = model(**inputs)
-    probs = softmax(outputs.logits.detach().numpy()[0])
-    return dict(zip(['negative', 'neutral', 'positive'], probs))
+    probs = get_sentiments([tweet])[0]
+    return dict(zip(SENTIMENT_LABELS, probs))
+
+@lru_cache(maxsize=8)
+def compile_keywords(keywords):
+    return KeywordMatcher(keywords)
+
+def get_interest_matcher(interests):
+    # One compiled matcher per distinct set of interest keywords
+    return compile_keywords(tuple(keyword for keywords in interests.values() 
+                                  for keyword in keywords))
 
 def tweet_mentions_interests(tweet, interests):
-    tweet_lower = tweet.lower()
-    return any(keyword.lower() in tweet_lower for keywords in interests.values() for keyword in keywords)
+    return get_interest_matcher(interests).matches(tweet)
 
 def process_data(df, interests):
-    df['mentions_interest'] = df['tweet'].apply(lambda x: tweet_mentions_interests(x, interests))
+    df['mentions_interest'] = get_interest_matcher(interests).contains(df['tweet'])
     filtered_df = df[df['mentions_interest']].copy()
-    filtered_df['sentiment'] = filtered_df['tweet'].apply(get_sentiment)
-    return filtered_df
 
-def extract_sentiment_scores(df):
-    for sentiment in ['negative', 'neutral', 'positive']:
-        df[sentiment] = df['sentiment'].apply(lambda x: x[sentiment])
-    return df
+    # Only score tweets without precomputed sentiment (e.g. from the feature store)
+    for sentiment in SENTIMENT_LABELS:
+        if sentiment not in filtered_df:
+            filtered_df[sentiment] = np.nan
+    missing = filtered_df[SENTIMENT_LABELS].isna().any(axis=1)
+    if missing.any():
+        scores = get_sentiments(filtered_df.loc[missing, 'tweet'].tolist())
+        filtered_df.loc[missing, SENTIMENT_LABELS] = scores
+    return filtered_df
 
 def normalize_data(df):
     scaler = StandardScaler()
-    df[['negative', 'neutral', 'positive']] = scaler.fit_transform(df[['negative', 'neutral', 'positive']])
+    with stage('scaling'):
+        df[SENTIMENT_LABELS] = scaler.fit_transform(df[SENTIMENT_LABELS])
     return df
 
+@stage('clustering')
 def cluster_data(df, n_clusters):
-    kmeans = KMeans(n_clusters=n_clusters, random_state=0, n_init=10).fit(df[['negative', 'neutral', 'positive']])
-    df['cluster'] = kmeans.predict(df[['negative', 'neutral', 'positive']])
+    kmeans = KMeans(n_clusters=n_clusters, random_state=0, n_init=10).fit(df[SENTIMENT_LABELS])
+    df['cluster'] = kmeans.predict(df[SENTIMENT_LABELS])
     return df, kmeans
 
 def get_names_by_cluster(df):
@@ -46,22 +82,7 @@ def get_names_by_cluster(df):
     return grouped
 
 def main(df):
-    interests = {
-        "gardening": ["gardening", "planting", "landscaping"],
-        "cuisine": ["cuisine", "cooking", "culinary arts", "gastronomy"],
-        "museums": ["museums", "exhibitions", "art galleries", "cultural centres"],
-        "walking": ["walking", "strolling", "treading"],
-        "parks": ["parks", "public gardens", "recreational areas"],
-        "hiking": ["hiking", "trekking", "trail hiking"],
-        "outdoors": ["park", "garden", "trail", "hiking", "walking", "strolling", "trekking", "outdoor", "nature"],
-        "leisure": ["museum", "theatre", "cinema", "concert", "gallery", "exhibit", "show", "event"],
-        "sports": ["sports", "soccer", "tennis", "basketball", "football", "baseball", "golf", "fitness", "gym"],
-        "travel": ["travel", "vacation", "trip", "expedition", "cruise", "tour", "journey"],
-        "food": ["cuisine", "cooking", "eating", "dining", "foodie", "gastronomy", "culinary"]
-    }
-    
-    processed_df = process_data(df, interests)
-    processed_df = extract_sentiment_scores(processed_df)
+    processed_df = process_data(df, INTERESTS)
     processed_df = normalize_data(processed_df)
     clustered_df, kmeans_model = cluster_data(processed_df, 5)  
     grouped_names = get_names_by_cluster(clustered_df)
@@ -0,0 +1,53 @@
+import re
+import pandas as pd
+
+class KeywordMatcher:
+    """
+    Case-insensitive substring matcher for a set of keywords, compiled once
+    into a single regex alternation and applied to whole columns with
+    pandas' vectorized string methods.
+
+    Arguments
+    ---------
+    keywords (iterable):  The keywords to look for.
+
+    """
+
+    def __init__(self, keywords):
+        # Longest first, so overlapping keywords match as a whole
+        self.keywords = sorted({keyword.lower() for keyword in keywords if keyword},
+                               key=lambda keyword: (-len(keyword), keyword))
+        self.regex = None
+        if self.keywords:
+            pattern = '|'.join(re.escape(keyword) for keyword in self.keywords)
+            self.regex = re.compile(pattern, re.IGNORECASE)
+
+    def matches(self, text):
+        return self.regex is not None and self.regex.search(str(text)) is not None
+
+    def contains(self, texts):
+        # Boolean Series, True where any keyword occurs
+        if self.regex is None:
+            return pd.Series(False, index=texts.index)
+        return texts.astype(str).str.contains(self.regex)
+
+    def count(self, texts):
+        # Number of distinct keywords occurring in each text
+        if self.regex is None:
+            return pd.Series(0, index=texts.index)
+        return texts.astype(str).str.findall(self.regex)\
+            .map(lambda found: len({keyword.lower() for keyword in found}))
+
+    def rank(self, texts):
+        """
+        Return the distinct texts containing a keyword, ordered by number of
+        distinct keywords they contain, so a keyword repeated in a text
+        counts once (ties keep their first-seen order).
+
+        """
+        texts = texts.dropna().astype(str)
+        counts = self.count(texts)
+        matched = pd.DataFrame({'text': texts[counts > 0], 'count': counts[counts > 0]})
+        ranked = matched.groupby('text', sort=False)['count'].max()\
+            .sort_values(ascending=False, kind='stable')
+        return ranked.index.tolist()
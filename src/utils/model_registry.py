@@ -0,0 +1,154 @@
+import logging
+import os
+import threading
+import time
+import torch
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+from utils.backends import BACKENDS, convert_model
+
+logger = logging.getLogger(__name__)
+
+# Hugging Face model of each registered name
+MODELS = {
+    'sentiment': 'cardiffnlp/twitter-roberta-base-sentiment',
+    'personality': 'Minej/bert-base-personality'
+}
+
+# If set, models are loaded from <TRAVELINK_MODEL_DIR>/<model id> when present
+MODEL_DIR_ENV = 'TRAVELINK_MODEL_DIR'
+
+# 'fp32' (default), 'int8' or 'onnx', see utils.backends
+BACKEND_ENV = 'TRAVELINK_INFERENCE_BACKEND'
+
+# If set, the number of torch intra-op CPU threads, applied when the first
+# model of the process is loaded
+TORCH_THREADS_ENV = 'TRAVELINK_TORCH_THREADS'
+
+_models = {}
+_loaders = {}
+_versions = {}
+_load_times = {}
+_locks = {}
+_registry_lock = threading.Lock()
+
+def model_source(name):
+    """
+    Return where the named model is loaded from: a local directory under
+    TRAVELINK_MODEL_DIR if it exists, otherwise the Hugging Face model id.
+
+    """
+    model_id = MODELS[name]
+    model_dir = os.environ.get(MODEL_DIR_ENV)
+    if model_dir:
+        local_path = os.path.join(model_dir, model_id)
+        if os.path.isdir(local_path):
+            return local_path
+    return model_id
+
+def load_pretrained(name):
+    source = model_source(name)
+    local_files_only = os.path.isdir(source)
+    tokenizer = AutoTokenizer.from_pretrained(source, local_files_only=local_files_only)
+    model = AutoModelForSequenceClassification.from_pretrained(source,
+                                                               local_files_only=local_files_only)
+    model.eval()
+    return tokenizer, model
+
+def inference_backend():
+    backend = os.environ.get(BACKEND_ENV, 'fp32')
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown {BACKEND_ENV}: {backend}. Choose from {BACKENDS}.')
+    return backend
+
+def load_model(name, backend='fp32'):
+    """
+    Load a fresh, uncached (tokenizer, model) pair of the named model with
+    its registered loader, converted to an inference backend.
+
+    """
+    tokenizer, model = _loaders.get(name, lambda: load_pretrained(name))()
+    return tokenizer, convert_model(tokenizer, model, backend)
+
+def register_model(name, loader, version=None):
+    """
+    Replace how the named model is loaded, e.g. with a small local stand-in.
+    loader() must return a (tokenizer, model) pair. Any loaded instance of
+    the model is discarded. Scores of a model registered without a version
+    are not persisted in the score cache.
+
+    """
+    with _registry_lock:
+        _loaders[name] = loader
+        _versions[name] = version
+        _models.pop(name, None)
+        _load_times.pop(name, None)
+
+def get_model(name):
+    """
+    Return the (tokenizer, model) pair of the named model, loading it on
+    first use with the TRAVELINK_INFERENCE_BACKEND backend (and, for the
+    first model, TRAVELINK_TORCH_THREADS threads). Loaded models are shared
+    by every caller in the process.
+
+    Arguments
+    ---------
+    name (str):  A registered model name, e.g. 'sentiment' or 'personality'.
+
+    Returns
+    -------
+    tokenizer, model:  The Hugging Face tokenizer and classification model.
+
+    """
+    loaded = _models.get(name)
+    if loaded is not None:
+        return loaded
+
+    with _registry_lock:
+        lock = _locks.setdefault(name, threading.Lock())
+
+    # Only one thread loads a given model, others wait for it
+    with lock:
+        loaded = _models.get(name)
+        if loaded is None:
+            threads = os.environ.get(TORCH_THREADS_ENV)
+            if threads and not _models:
+                torch.set_num_threads(int(threads))
+            start = time.perf_counter()
+            backend = inference_backend()
+            loaded = load_model(name, backend)
+            _load_times[name] = time.perf_counter() - start
+            _models[name] = loaded
+            logger.info('Loaded %s model (%s) in %.2fs', name, backend, _load_times[name])
+    return loaded
+
+def model_version(name):
+    """
+    Identify the outputs of the named model, i.e. its weights and inference
+    backend, e.g. to tag cached scores. None for a model registered without
+    a version.
+
+    """
+    version = _versions.get(name, MODELS[name])
+    if version is None:
+        return None
+    return f'{version}:{inference_backend()}'
+
+def is_loaded(name):
+    return name in _models
+
+def get_load_times():
+    # Seconds each loaded model took to load
+    return dict(_load_times)
+
+def save_model(name, directory):
+    """
+    Save the named model under directory so it can be loaded offline by
+    pointing TRAVELINK_MODEL_DIR at directory. The fp32 weights are saved,
+    whatever the inference backend.
+
+    """
+    tokenizer, model = load_model(name)
+    path = os.path.join(directory, MODELS[name])
+    tokenizer.save_pretrained(path)
+    model.save_pretrained(path)
+    return path
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import KDTree
+
+class PersonalityIndex:
+    """
+    Nearest-neighbour index over standardized Big-Five vectors, used to find
+    the travellers with the closest personality instead of everyone in the
+    same cluster.
+
+    Arguments
+    ---------
+    features (DataFrame):    Trait columns and the 'Trip ID' of each row.
+    feature_columns (list):  The trait columns.
+    leaf_size (int):         KD-tree leaf size.
+
+    """
+
+    def __init__(self, features, feature_columns, leaf_size=40):
+        self.feature_columns = list(feature_columns)
+        self.trip_ids = features['Trip ID'].values
+        self.positions = pd.Index(self.trip_ids)
+        values = features[self.feature_columns].to_numpy(dtype='float64')
+        self.mean = values.mean(axis=0)
+        self.scale = values.std(axis=0)
+        self.scale[self.scale == 0] = 1.0
+        self.vectors = self.transform(values)
+        self.tree = KDTree(self.vectors, leaf_size=leaf_size)
+
+    def __len__(self):
+        return len(self.trip_ids)
+
+    def transform(self, values):
+        return (np.asarray(values, dtype='float64') - self.mean) / self.scale
+
+    def query(self, features, k=10, candidate_ids=None, brute_force_limit=4096):
+        """
+        Return the Trip IDs of the k nearest travellers and their distances,
+        closest first.
+
+        Arguments
+        ---------
+        features (DataFrame):     The query traveller's traits (one row).
+        k (int):                  Maximum number of neighbours.
+        candidate_ids (array):    Optional pre-filter: only these trips are
+                                  considered. Small candidate sets are searched
+                                  exhaustively, large ones through the tree.
+        brute_force_limit (int):  Largest candidate set searched exhaustively.
+
+        Returns
+        -------
+        trip_ids (ndarray), distances (ndarray)
+
+        """
+        vector = self.transform(features[self.feature_columns].to_numpy()[:1])
+        if len(self) == 0:
+            return self.trip_ids[:0], np.empty(0)
+        if candidate_ids is None:
+            distances, positions = self.tree.query(vector, k=min(k, len(self)))
+            return self.trip_ids[positions[0]], distances[0]
+
+        positions = self.positions.get_indexer(candidate_ids)
+        positions = positions[positions >= 0]
+        if len(positions) <= brute_force_limit:
+            distances = np.linalg.norm(self.vectors[positions] - vector, axis=1)
+            nearest = np.argsort(distances, kind='stable')[:k]
+            return self.trip_ids[positions[nearest]], distances[nearest]
+
+        # Widen the tree query until enough of the results are candidates
+        is_candidate = np.zeros(len(self), dtype=bool)
+        is_candidate[positions] = True
+        n_query = 4 * k
+        while True:
+            distances, nearest = self.tree.query(vector, k=min(n_query, len(self)))
+            keep = is_candidate[nearest[0]]
+            if keep.sum() >= k or n_query >= len(self):
+                break
+            n_query *= 4
+        return self.trip_ids[nearest[0][keep][:k]], distances[0][keep][:k]
@@ -1,37 +1,39 @@
-import torch
 import pandas as pd
-from transformers import AutoModelForSequenceClassification, AutoTokenizer
 from sklearn.preprocessing import StandardScaler
 from sklearn.cluster import KMeans
+from utils.batching import score_model
+from utils.instrumentation import stage
+from utils.model_registry import model_version
+from utils.score_cache import cached_scores
 
-# Load tokenizer and model
-tokenizer = AutoTokenizer.from_pretrained('Minej/bert-base-personality')
-model = AutoModelForSequenceClassification.from_pretrained('Minej/bert-base-personality')
+PERSONALITY_LABELS = ["Openness", "Conscientiousness", "Extraversion", "Agreeableness", "Neuroticism"]
 
 def predict_personality(texts, batch_size=128):
-    labels = ["Openness", "Conscientiousness", "Extraversion", "Agreeableness", "Neuroticism"]
-    results = []
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i+batch_size]
-        inputs = tokenizer(batch, return_tensors="pt", padding=True, truncation=True, max_length=512)
-        with torch.no_grad():
-            outputs = model(**inputs)
-        logits = outputs.logits
-        probabilities = torch.nn.functional.softmax(logits, dim=-1).tolist()
-        batch_results = [{label: prob for label, prob in zip(labels, probs)} for probs in probabilities]
-        results.extend(batch_results)
+    labels = PERSONALITY_LABELS
+    probabilities = cached_scores('personality', model_version('personality'), texts,
+                                  lambda texts: score_model('personality', texts,
+                                                            batch_size=batch_size)).tolist()
+    results = [{label: prob for label, prob in zip(labels, probs)} for probs in probabilities]
     return results
 
 def extract_features(df):
-    features = predict_personality(df['tweet'].tolist())
-    return pd.DataFrame(features, columns=["Openness", "Conscientiousness", "Extraversion", "Agreeableness", "Neuroticism"])
+    # Reuse precomputed traits (e.g. from the feature store) and only score the rest
+    features = df.reindex(columns=PERSONALITY_LABELS).astype(float).reset_index(drop=True)
+    missing = features.isna().any(axis=1)
+    if missing.any():
+        tweets = df['tweet'][missing.values].tolist()
+        scores = pd.DataFrame(predict_personality(tweets), columns=PERSONALITY_LABELS)
+        features.loc[missing, PERSONALITY_LABELS] = scores.values
+    return features
 
 def perform_clustering(df, n_clusters=5):
     features = extract_features(df)
     scaler = StandardScaler()
-    features_scaled = scaler.fit_transform(features)
+    with stage('scaling'):
+        features_scaled = scaler.fit_transform(features)
     kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-    kmeans.fit(features_scaled)
+    with stage('clustering'):
+        kmeans.fit(features_scaled)
     return kmeans.labels_
 
 # Load data
@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+from utils.trip_index import parse_dates, to_day_numbers
+
+# Dataset column of each TravellerRecord field
+RECORD_FIELDS = {
+    'trip_id': 'Trip ID',
+    'name': 'Traveller Name',
+    'arrival_day': 'Arrival Date',
+    'return_day': 'Return Date',
+    'departure_city': 'Departure City',
+    'arrival_city': 'Arrival City',
+    'company': 'company',
+    'networking': 'networking',
+    'mood': 'mood',
+    'free_time': 'free_time',
+    'accommodation': 'accommodation',
+    'tweet': 'tweet',
+    'music_genre': 'Music Genre',
+    'club': 'Suggested Club/Pub'
+}
+
+# Columns kept as integer code arrays by EncodedTravellers
+ENCODED_COLUMNS = ['Arrival City', 'company', 'mood', 'free_time', 'accommodation']
+
+def to_day_number(date, column):
+    # Day number of one date, rejecting a missing date rather than turning it into day 0
+    days = pd.DatetimeIndex(np.atleast_1d(parse_dates(date)))
+    if len(days) != 1 or days.isna()[0]:
+        raise ValueError(f'Invalid {column}: {date!r}')
+    return int(to_day_numbers(days)[0])
+
+def day_to_date(day):
+    return np.datetime64(int(day), 'D').astype('datetime64[ns]')
+
+class TravellerRecord:
+    """
+    A single traveller, e.g. the one being matched, without the overhead of
+    a DataFrame row: dates are int32 day numbers and any extra values (such
+    as precomputed model features) are kept in a small dict.
+
+    """
+    __slots__ = tuple(RECORD_FIELDS) + ('features',)
+
+    def __init__(self, **fields):
+        for field in RECORD_FIELDS:
+            setattr(self, field, fields.get(field))
+        self.features = fields.get('features') or {}
+
+    @classmethod
+    def from_dict(cls, traveller):
+        """
+        Build a record from a dict keyed by dataset column (dates as
+        dd/mm/YYYY strings or dates). Keys that are not dataset columns are
+        kept as features. Raises a ValueError if a date is missing.
+
+        """
+        fields = {field: traveller.get(column) for field, column in RECORD_FIELDS.items()}
+        fields['arrival_day'] = to_day_number(fields['arrival_day'], 'Arrival Date')
+        fields['return_day'] = to_day_number(fields['return_day'], 'Return Date')
+        fields['networking'] = bool(fields['networking'])
+        columns = set(RECORD_FIELDS.values())
+        fields['features'] = {key: value for key, value in traveller.items()
+                              if key not in columns}
+        return cls(**fields)
+
+    def to_dict(self):
+        # Dataset columns and features, dates as datetimes
+        traveller = {column: getattr(self, field) for field, column in RECORD_FIELDS.items()}
+        traveller['Arrival Date'] = day_to_date(self.arrival_day)
+        traveller['Return Date'] = day_to_date(self.return_day)
+        traveller.update(self.features)
+        return traveller
+
+    def to_frame(self, columns=None):
+        """
+        One-row DataFrame of the record in the dataset's column layout, with
+        the features as extra columns.
+
+        """
+        traveller = self.to_dict()
+        columns = list(columns if columns is not None else RECORD_FIELDS.values())
+        columns += [column for column in traveller if column not in columns]
+        return pd.DataFrame({column: [traveller.get(column)] for column in columns})
+
+class EncodedTravellers:
+    """
+    Compact view of the traveller data used for filtering: categorical code
+    arrays, int32 day numbers and the networking flags, built once per data
+    version. Filters return row positions, so the population is never copied.
+
+    Arguments
+    ---------
+    df (DataFrame):  Traveller data with categorical ENCODED_COLUMNS.
+
+    """
+
+    def __init__(self, df):
+        self.codes = {}
+        self.categories = {}
+        for column in ENCODED_COLUMNS:
+            values = df[column].astype('category')
+            self.codes[column] = values.cat.codes.values
+            self.categories[column] = {value: code for code, value
+                                       in enumerate(values.cat.categories)}
+        self.networking = df['networking'].values.astype(bool)
+        self.arrival_days = to_day_numbers(df['Arrival Date'])
+        self.return_days = to_day_numbers(df['Return Date'])
+
+    def __len__(self):
+        return len(self.networking)
+
+    def code(self, column, value):
+        # Code of a value, -1 (matching nothing) if it does not occur
+        return self.categories[column].get(value, -1)
+
+    def basic_matches(self, positions, record):
+        """
+        Return the positions among positions that match record on the Basic
+        plan: same free time, mood and networking preference, and a different
+        company when networking (the same company otherwise).
+
+        """
+        same_company = self.codes['company'][positions] == self.code('company', record.company)
+        mask = (
+            (self.codes['free_time'][positions] == self.code('free_time', record.free_time)) &
+            (self.codes['mood'][positions] == self.code('mood', record.mood)) &
+            (self.networking[positions] == record.networking) &
+            (~same_company if record.networking else same_company)
+        )
+        return positions[mask]
+
+    def nbytes(self):
+        arrays = list(self.codes.values()) + [self.networking, self.arrival_days, self.return_days]
+        return sum(array.nbytes for array in arrays)
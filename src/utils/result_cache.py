@@ -0,0 +1,88 @@
+import os
+import threading
+from cachetools import TTLCache
+from utils.instrumentation import count
+
+# Fields of the new traveller that determine the matching travellers. The
+# genres only rank the clubs, which is done after the cache, and are looked
+# up while the match runs, so they are not part of the key
+PROFILE_FIELDS = ['Arrival City', 'Arrival Date', 'Return Date', 'company',
+                  'networking', 'mood', 'free_time', 'tweet']
+
+def data_version(*paths):
+    """
+    Identify the current version of the data files a result depends on by
+    their modification time and size. Missing files are part of the version,
+    so building one later also changes it.
+
+    """
+    version = []
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            version.append((path, stat.st_mtime_ns, stat.st_size))
+        else:
+            version.append((path, None, None))
+    return tuple(version)
+
+def make_cache_key(new_traveller, plan):
+    # Hashable key from the profile fields of a new traveller dict
+    values = []
+    for field in PROFILE_FIELDS:
+        value = new_traveller.get(field)
+        if isinstance(value, list):
+            value = tuple(value)
+        values.append(str(value) if field.endswith('Date') else value)
+    return (plan,) + tuple(values)
+
+class MatchResultCache:
+    """
+    Bounded TTL cache of match results for one data version, with hit and
+    miss counters. Results are cleared whenever the data version changes.
+
+    Arguments
+    ---------
+    maxsize (int):  Maximum number of cached results.
+    ttl (int):      Seconds a result is kept.
+
+    """
+
+    def __init__(self, maxsize=256, ttl=600):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.lock = threading.Lock()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+
+    def set_version(self, version):
+        with self.lock:
+            if version != self.version:
+                self.cache.clear()
+                self.version = version
+
+    def get_or_compute(self, key, compute):
+        with self.lock:
+            result = self.cache.get(key)
+            if result is not None:
+                self.hits += 1
+                count('result_cache_hits')
+                return result
+            self.misses += 1
+            count('result_cache_misses')
+            version = self.version
+
+        result = compute()
+        with self.lock:
+            # Don't store results computed against an outdated version
+            if version == self.version:
+                self.cache[key] = result
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self.cache), 'maxsize': self.cache.maxsize}
@@ -0,0 +1,268 @@
+import hashlib
+import os
+import struct
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from utils.instrumentation import count
+
+# Directory of the on-disk score caches, 'off' disables caching
+SCORE_CACHE_ENV = 'TRAVELINK_SCORE_CACHE'
+SCORE_CACHE_DIR = './src/data/score_cache'
+
+# File header: magic, number of scores per text, length of the version tag
+MAGIC = b'TLSCORE1'
+HEADER = struct.Struct('<8sII')
+KEY_SIZE = 16
+
+# Records kept outside the sorted index (new ones, in a dict) before the
+# index is rebuilt: at least MIN_OVERFLOW, at most a share of the index
+MIN_OVERFLOW = 1024
+MAX_OVERFLOW_SHARE = 0.125
+
+def normalize_text(text):
+    # Unicode NFC with whitespace runs collapsed; this is the text that is scored
+    return ' '.join(unicodedata.normalize('NFC', str(text)).split())
+
+def text_key(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=KEY_SIZE).digest()
+
+class ScoreCache:
+    """
+    Model outputs keyed by a hash of the normalized text, for one model
+    version. Scores are appended to a compact binary file (fixed-size
+    records of key and float32 scores, safe to share between processes) and
+    the most recently used ones are also kept in memory. The records on
+    disk are found through a sorted index; records written since (by this
+    or another process) are kept in a small overflow until it is rebuilt.
+
+    Arguments
+    ---------
+    path (str):     Cache file, or None to keep scores in memory only.
+    version (str):  Identifies the model (weights and backend) whose scores
+                    are stored, checked against the file's tag.
+    maxsize (int):  Number of scores kept in the in-memory LRU.
+
+    """
+
+    def __init__(self, path=None, version='', maxsize=10000):
+        self.path = path
+        self.version = version
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.recent = OrderedDict()
+        self.width = None
+        self.header_size = None
+        self.read_size = None
+        self.keys = np.empty(0, dtype=f'S{KEY_SIZE}')
+        self.order = np.empty(0, dtype='int64')
+        self.records = None
+        self.overflow = {}
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    # Disk
+    # ----
+
+    def record_dtype(self):
+        return np.dtype([('key', f'S{KEY_SIZE}'), ('scores', '<f4', (self.width,))])
+
+    def read_header(self, file):
+        magic, width, tag_size = HEADER.unpack(file.read(HEADER.size))
+        tag = file.read(tag_size).decode('utf-8')
+        if magic != MAGIC or tag != self.version:
+            raise ValueError(f'{self.path} is not a score cache of model version {self.version}')
+        return width, HEADER.size + tag_size
+
+    def load(self):
+        # Index the records on disk; a partly written last record is ignored
+        with open(self.path, 'rb') as file:
+            self.width, self.header_size = self.read_header(file)
+        itemsize = self.record_dtype().itemsize
+        n_records = (os.path.getsize(self.path) - self.header_size) // itemsize
+        self.read_size = self.header_size + n_records * itemsize
+        self.overflow = {}
+        if n_records:
+            self.records = np.memmap(self.path, dtype=self.record_dtype(), mode='r',
+                                     offset=self.header_size, shape=(n_records,))
+            self.order = np.argsort(self.records['key'], kind='stable')
+            self.keys = self.records['key'][self.order]
+
+    def find(self, key):
+        # Keys read back from 'S' arrays lose their trailing NUL bytes
+        key = key.rstrip(b'\0')
+        scores = self.overflow.get(key)
+        if scores is not None:
+            return scores
+        position = np.searchsorted(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+            return np.array(self.records['scores'][self.order[position]])
+        return None
+
+    def append(self, keys, scores):
+        if self.path is None:
+            return
+        if self.width is None:
+            self.create(scores.shape[1])
+        records = np.empty(len(keys), dtype=self.record_dtype())
+        records['key'] = keys
+        records['scores'] = scores
+        # One write in append mode, so concurrent writers don't interleave records
+        descriptor = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        try:
+            # Drop the partial record of an interrupted write first
+            size = os.fstat(descriptor).st_size
+            torn = (size - self.header_size) % records.itemsize
+            if torn:
+                size -= torn
+                os.ftruncate(descriptor, size)
+            os.write(descriptor, records.tobytes())
+            written = os.fstat(descriptor).st_size == size + records.nbytes
+        finally:
+            os.close(descriptor)
+        # Found without re-reading the file. If nobody else wrote since it was
+        # last read, the records don't need to be read back either
+        self.overflow.update(zip(records['key'], records['scores']))
+        if written and size == self.read_size:
+            self.read_size = size + records.nbytes
+
+    def create(self, width):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tag = self.version.encode('utf-8')
+        try:
+            descriptor = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except FileExistsError:
+            # Created by another process in the meantime
+            self.load()
+            return
+        try:
+            os.write(descriptor, HEADER.pack(MAGIC, width, len(tag)) + tag)
+        finally:
+            os.close(descriptor)
+        self.load()
+
+    def refresh(self):
+        """
+        Pick up records appended by other processes since the file was last
+        read: only the new tail is read, into the overflow. The index is
+        rebuilt once the overflow is large.
+
+        """
+        if self.path is None or not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        if self.width is None or size < self.read_size:
+            # Created by another process, or replaced
+            self.load()
+            return
+        itemsize = self.record_dtype().itemsize
+        n_records = (size - self.read_size) // itemsize
+        if n_records:
+            with open(self.path, 'rb') as file:
+                file.seek(self.read_size)
+                tail = np.frombuffer(file.read(n_records * itemsize), dtype=self.record_dtype())
+            self.read_size += n_records * itemsize
+            self.overflow.update(zip(tail['key'], tail['scores']))
+        if len(self.overflow) > max(MIN_OVERFLOW, MAX_OVERFLOW_SHARE * len(self.keys)):
+            self.load()
+
+    # Lookup
+    # ------
+
+    def remember(self, key, scores):
+        self.recent[key] = scores
+        self.recent.move_to_end(key)
+        if len(self.recent) > self.maxsize:
+            self.recent.popitem(last=False)
+
+    def lookup(self, keys):
+        # Cached scores of the keys that are known
+        found = {}
+        missing = []
+        for key in keys:
+            scores = self.recent.get(key)
+            if scores is not None:
+                self.recent.move_to_end(key)
+                found[key] = scores
+            else:
+                missing.append(key)
+        if missing and self.path is not None:
+            self.refresh()
+            for key in missing:
+                scores = self.find(key)
+                if scores is not None:
+                    self.remember(key, scores)
+                    found[key] = scores
+        return found
+
+    def get_or_score(self, texts, score):
+        """
+        Return the scores of texts, scoring only the distinct normalized
+        texts that are not cached yet.
+
+        Arguments
+        ---------
+        texts (list):        The texts to score.
+        score (callable):    score(texts) returns an array of shape
+                             (len(texts), n_scores).
+
+        Returns
+        -------
+        scores (ndarray):  float32 array of shape (len(texts), n_scores).
+
+        """
+        normalized = [normalize_text(text) for text in texts]
+        keys = [text_key(text) for text in normalized]
+        with self.lock:
+            found = self.lookup(dict.fromkeys(keys))
+        new_texts = {key: text for key, text in zip(keys, normalized) if key not in found}
+        count('score_cache_hits', len(texts) - sum(key in new_texts for key in keys))
+        count('score_cache_misses', len(new_texts))
+
+        if new_texts:
+            scores = np.asarray(score(list(new_texts.values())), dtype='float32')
+            with self.lock:
+                self.append(list(new_texts), scores)
+                for key, row in zip(new_texts, scores):
+                    self.remember(key, row)
+                    found[key] = row
+
+        if not keys:
+            return np.empty((0, 0), dtype='float32')
+        return np.stack([found[key] for key in keys]).astype('float32')
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def cache_path(name, version, directory):
+    # One file per model version
+    return os.path.join(directory, f'{name}-{hashlib.sha1(version.encode()).hexdigest()[:12]}.bin')
+
+def get_score_cache(name, version):
+    """
+    Return the shared ScoreCache of a model version, stored under
+    TRAVELINK_SCORE_CACHE (default SCORE_CACHE_DIR). A model without a
+    version, e.g. a custom registered one, is only cached in memory.
+
+    Returns
+    -------
+    cache (ScoreCache):  None if caching is turned off.
+
+    """
+    directory = os.environ.get(SCORE_CACHE_ENV, SCORE_CACHE_DIR)
+    if directory == 'off':
+        return None
+    with _caches_lock:
+        cache = _caches.get((name, version, directory))
+        if cache is None:
+            path = cache_path(name, version, directory) if version is not None else None
+            cache = _caches[(name, version, directory)] = ScoreCache(path, version or '')
+        return cache
+
+def cached_scores(name, version, texts, score):
+    # Scores of texts from the model's cache, or score(texts) if caching is off
+    cache = get_score_cache(name, version)
+    if cache is None:
+        return score(list(texts))
+    return cache.get_or_score(texts, score)
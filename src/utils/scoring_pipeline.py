@@ -0,0 +1,152 @@
+import json
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import pandas as pd
+import torch
+from utils.dataset import csv_source
+from utils.feature_store import FEATURE_COLUMNS, score_tweets, tweet_hash
+from utils.model_registry import get_model, inference_backend, model_version
+
+MANIFEST_FILE = 'manifest.json'
+
+MODEL_NAMES = ['sentiment', 'personality']
+
+# Worker side
+# -----------
+
+def init_worker(threads_per_worker):
+    # Load both models once per worker process, then pin its torch threads
+    # (after the first load, which applies TRAVELINK_TORCH_THREADS)
+    for name in MODEL_NAMES:
+        get_model(name)
+    torch.set_num_threads(threads_per_worker)
+
+def score_chunk(tweets, batch_size):
+    return score_tweets(tweets, batch_size=batch_size).values
+
+# Driver side
+# -----------
+
+def chunk_path(checkpoint_dir, chunk_id):
+    return os.path.join(checkpoint_dir, f'chunk-{chunk_id:06d}.parquet')
+
+def check_manifest(checkpoint_dir, input_path, chunk_size):
+    """
+    Record the input (its path, size and hash), chunk size, models and
+    inference backend of a run, and refuse to resume a run whose checkpoints
+    were cut from another version of the input, cut differently or scored
+    by other models.
+
+    """
+    manifest = {'input': os.path.abspath(input_path), 'source': csv_source(input_path),
+                'chunk_size': chunk_size,
+                'models': {name: model_version(name) for name in MODEL_NAMES},
+                'backend': inference_backend()}
+    path = os.path.join(checkpoint_dir, MANIFEST_FILE)
+    if os.path.exists(path):
+        with open(path, 'r') as file:
+            previous = json.load(file)
+        if previous != manifest:
+            raise ValueError(f'Checkpoints in {checkpoint_dir} belong to a different run: '
+                             f'{previous}. Use another checkpoint directory.')
+    else:
+        with open(path, 'w') as file:
+            json.dump(manifest, file)
+
+def save_checkpoint(chunk, features, path):
+    # Write to a temporary file first so a crash never leaves a partial chunk
+    scored = chunk.reset_index(drop=True)
+    scored['tweet_hash'] = scored['tweet'].map(tweet_hash)
+    scored[FEATURE_COLUMNS] = pd.DataFrame(features, columns=FEATURE_COLUMNS)
+    tmp_path = f'{path}.tmp'
+    scored.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+def run_scoring_pipeline(input_path, checkpoint_dir, chunk_size=10000, workers=None,
+                         threads_per_worker=1, batch_size=64, on_chunk=None):
+    """
+    Score every tweet of a CSV with both models on a pool of processes.
+
+    The CSV is streamed in chunks of chunk_size rows. Each chunk's tweets are
+    scored by a worker process that loaded the models once, and the scored
+    chunk is checkpointed to checkpoint_dir. Chunks already checkpointed by
+    an earlier, interrupted run are skipped. At most two chunks per worker
+    are held in memory.
+
+    Arguments
+    ---------
+    input_path (str):          CSV with 'Trip ID' and 'tweet' columns.
+    checkpoint_dir (str):      Directory for the per-chunk checkpoints.
+    chunk_size (int):          Rows per chunk.
+    workers (int):             Worker processes, defaults to the CPU count.
+    threads_per_worker (int):  torch threads per worker.
+    batch_size (int):          Tweets per forward pass.
+    on_chunk (callable):       Optional progress callback, called with the
+                               chunk id and number of tweets of every chunk
+                               scored.
+
+    Returns
+    -------
+    n_chunks (int), n_scored (int):  Total chunks and chunks scored by this run.
+
+    """
+    workers = workers or os.cpu_count()
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    check_manifest(checkpoint_dir, input_path, chunk_size)
+
+    n_chunks = n_scored = 0
+    pending = {}
+
+    def collect(done):
+        nonlocal n_scored
+        for future in done:
+            chunk_id, chunk = pending.pop(future)
+            save_checkpoint(chunk, future.result(), chunk_path(checkpoint_dir, chunk_id))
+            n_scored += 1
+            if on_chunk is not None:
+                on_chunk(chunk_id, len(chunk))
+
+    # Spawn fresh workers rather than forking a process with torch state
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=init_worker,
+                             initargs=(threads_per_worker,)) as pool:
+        for chunk_id, chunk in enumerate(pd.read_csv(input_path, chunksize=chunk_size)):
+            n_chunks += 1
+            if os.path.exists(chunk_path(checkpoint_dir, chunk_id)):
+                continue
+
+            # Bound the number of chunks in flight
+            if len(pending) >= 2 * workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+            tweets = chunk['tweet'].astype(str).tolist()
+            future = pool.submit(score_chunk, tweets, batch_size)
+            pending[future] = (chunk_id, chunk)
+
+        collect(wait(pending).done)
+
+    return n_chunks, n_scored
+
+def iter_checkpoints(checkpoint_dir, n_chunks):
+    for chunk_id in range(n_chunks):
+        yield pd.read_parquet(chunk_path(checkpoint_dir, chunk_id))
+
+def write_scored_output(checkpoint_dir, n_chunks, output_path):
+    # Concatenate the checkpoints into one CSV, one chunk in memory at a time
+    for chunk_id, scored in enumerate(iter_checkpoints(checkpoint_dir, n_chunks)):
+        scored.drop(columns='tweet_hash').to_csv(output_path, index=False,
+                                                 mode='w' if chunk_id == 0 else 'a',
+                                                 header=chunk_id == 0)
+
+def write_feature_store(checkpoint_dir, n_chunks, store_path):
+    # Build the Parquet feature store from the checkpoints
+    store = pd.concat([scored[['Trip ID', 'tweet_hash'] + FEATURE_COLUMNS]
+                       for scored in iter_checkpoints(checkpoint_dir, n_chunks)],
+                      ignore_index=True)
+    store[FEATURE_COLUMNS] = store[FEATURE_COLUMNS].astype('float32')
+    store = store.set_index('Trip ID').sort_index()
+    store.to_parquet(store_path)
+    return store
@@ -0,0 +1,324 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing.connection import wait
+from utils.async_pipeline import match_concurrently
+from utils.dataset import DATASET_CSV_PATH, DATASET_PATH, load_city_counts
+from utils.engine import MatchEngine
+
+logger = logging.getLogger(__name__)
+
+CITIES_PATH = './src/data/datasets/cities.txt'
+
+# Seconds a blocking router call waits for its shard before giving up
+RESULT_TIMEOUT = 60
+
+# Seconds between checks that the router is closing
+POLL_INTERVAL = 1
+
+def load_cities(path=CITIES_PATH):
+    with open(path, 'r') as file:
+        return [city.strip() for city in file.read().splitlines() if city.strip()]
+
+def assign_shards(cities, n_shards, city_counts=None):
+    """
+    Split cities into n_shards groups with about the same number of trips,
+    largest cities first, each to the group with the fewest trips so far.
+
+    Arguments
+    ---------
+    cities (list):       The arrival cities.
+    n_shards (int):      Number of groups.
+    city_counts (dict):  Trips per city, cities are weighted equally if None.
+
+    Returns
+    -------
+    shards (list):  One list of cities per shard.
+
+    """
+    city_counts = city_counts or {}
+    shards = [[] for _ in range(n_shards)]
+    loads = [0] * n_shards
+    for city in sorted(cities, key=lambda city: -city_counts.get(city, 1)):
+        shard = loads.index(min(loads))
+        shards[shard].append(city)
+        loads[shard] += city_counts.get(city, 1)
+    return shards
+
+# Worker process
+# --------------
+
+def run_shard(cities, exclude_cities, requests, connection, engine_options, threads):
+    """
+    Serve the requests of one shard: a MatchEngine over the trips to its
+    cities, answering ('match', traveller, plan, timeouts), ('match_many',
+    travellers, plan) and ('stats',) requests from several threads, so
+    concurrent scoring requests are batched. Responses go back over the
+    shard's own pipe; a result that can't be pickled is reported as an
+    error. A None request, or the router exiting, stops the worker.
+
+    """
+    try:
+        engine = MatchEngine(cities=cities, exclude_cities=exclude_cities, refit=False,
+                             **engine_options)
+        error = None
+    except Exception as load_error:
+        logger.exception('Shard failed to load')
+        engine, error = None, load_error
+
+    send_lock = threading.Lock()
+
+    def respond(request_id, ok, result):
+        with send_lock:
+            connection.send((request_id, ok, result))
+
+    def handle(request_id, command, *args):
+        try:
+            if error is not None:
+                raise error
+            if command == 'match':
+                traveller, plan, timeouts = args
+                result = match_concurrently(engine, traveller, plan, timeouts=timeouts)
+            elif command == 'match_many':
+                result = engine.match_many(*args)
+            elif command == 'stats':
+                travellers = engine.data.travellers
+                result = {'cities': sorted(travellers['Arrival City'].astype(str).unique()),
+                          'trips': len(travellers),
+                          'cache': engine.result_cache.stats()}
+            else:
+                raise ValueError(f'Unknown shard command: {command}')
+            respond(request_id, True, result)
+        except Exception as request_error:
+            try:
+                respond(request_id, False, request_error)
+            except Exception:
+                respond(request_id, False, RuntimeError(repr(request_error)))
+
+    parent = multiprocessing.parent_process()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        while True:
+            try:
+                request = requests.get(timeout=1)
+            except queue.Empty:
+                # Don't outlive a router that was killed
+                if parent is not None and not parent.is_alive():
+                    break
+                continue
+            if request is None:
+                break
+            executor.submit(handle, *request)
+
+# Router
+# ------
+
+def resolve(future, ok, result):
+    # Set the result (or exception) of a request's Future, unless the caller
+    # cancelled it, e.g. after timing out
+    if future.set_running_or_notify_cancel():
+        if ok:
+            future.set_result(result)
+        else:
+            future.set_exception(result)
+
+class ShardRouter:
+    """
+    Matches travellers on worker processes that each own the trips to some
+    arrival cities (with their index, features and caches). All matches are
+    in the traveller's arrival city, so each request is sent to that city's
+    shard over a process queue and answered over the shard's own pipe.
+    Shard 0 also owns the cities that are not listed in cities.txt.
+
+    A worker that dies fails its pending requests with a RuntimeError and is
+    restarted; blocking calls give up after RESULT_TIMEOUT seconds.
+
+    Arguments
+    ---------
+    n_shards (int):           Number of worker processes, defaults to the
+                              number of CPUs.
+    cities_path (str):        List of arrival cities to shard.
+    threads_per_shard (int):  Requests handled concurrently by each worker.
+    dataset_path (str):       Typed Parquet dataset, to balance the shards.
+    csv_path (str):           Source CSV.
+    **engine_options:         Passed on to each worker's MatchEngine.
+
+    """
+
+    def __init__(self, n_shards=None, cities_path=CITIES_PATH, threads_per_shard=4,
+                 dataset_path=DATASET_PATH, csv_path=DATASET_CSV_PATH, **engine_options):
+        cities = load_cities(cities_path)
+        n_shards = min(n_shards or os.cpu_count() or 1, len(cities))
+        self.shards = assign_shards(cities, n_shards, load_city_counts(dataset_path, csv_path))
+        self.city_shard = {city: shard for shard, cities in enumerate(self.shards)
+                           for city in cities}
+        self.engine_options = dict(engine_options, dataset_path=dataset_path,
+                                   csv_path=csv_path)
+        self.threads_per_shard = threads_per_shard
+
+        self.context = multiprocessing.get_context('spawn')
+        self.requests = [None] * len(self.shards)
+        self.connections = [None] * len(self.shards)
+        self.processes = [None] * len(self.shards)
+        self.restarts = [0] * len(self.shards)
+        self.futures = {}
+        self.request_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.closing = False
+        for shard in range(len(self.shards)):
+            self.start_shard(shard)
+
+        self.dispatcher = threading.Thread(target=self.dispatch, name='travelink-shard-router',
+                                           daemon=True)
+        self.dispatcher.start()
+
+    def start_shard(self, shard):
+        # Start the worker of a shard with a new request queue and response pipe
+        if shard == 0:
+            owned = None
+            excluded = [city for other in self.shards[1:] for city in other] or None
+        else:
+            owned, excluded = self.shards[shard], None
+        self.requests[shard] = self.context.Queue()
+        reader, writer = self.context.Pipe(duplex=False)
+        process = self.context.Process(target=run_shard,
+                                       args=(owned, excluded, self.requests[shard], writer,
+                                             self.engine_options, self.threads_per_shard),
+                                       name=f'travelink-shard-{shard}', daemon=True)
+        process.start()
+        # Only the worker writes, so the reader sees EOF when it exits
+        writer.close()
+        self.connections[shard] = reader
+        self.processes[shard] = process
+
+    def dispatch(self):
+        # Resolve the futures of the responses coming back from the workers,
+        # and restart the workers that exit
+        while True:
+            with self.lock:
+                if self.closing:
+                    return
+                connections = list(self.connections)
+                sentinels = {process.sentinel: shard
+                             for shard, process in enumerate(self.processes)}
+            for ready in wait(connections + list(sentinels), timeout=POLL_INTERVAL):
+                # An error handling one response or worker must not stop the dispatcher
+                try:
+                    if ready in sentinels:
+                        self.restart_shard(sentinels[ready])
+                    else:
+                        self.receive(ready)
+                except Exception:
+                    logger.exception('Shard router failed to dispatch')
+
+    def receive(self, connection):
+        # Resolve the future of one response
+        try:
+            request_id, ok, result = connection.recv()
+        except (EOFError, OSError):
+            # The worker exited; handled through its sentinel
+            return
+        with self.lock:
+            shard_future = self.futures.pop(request_id, None)
+        if shard_future is not None:
+            resolve(shard_future[1], ok, result)
+
+    def restart_shard(self, shard):
+        # Fail the pending requests of a dead worker and start a new one
+        connection = self.connections[shard]
+        while connection.poll():
+            # Responses sent before it exited
+            self.receive(connection)
+        with self.lock:
+            if self.closing:
+                return
+            process = self.processes[shard]
+            process.join(POLL_INTERVAL)
+            logger.error('Shard %d exited with code %s, restarting it', shard, process.exitcode)
+            error = RuntimeError(f'Shard {shard} exited with code {process.exitcode}')
+            failed = []
+            for request_id, (request_shard, future) in list(self.futures.items()):
+                if request_shard == shard:
+                    del self.futures[request_id]
+                    failed.append(future)
+            # Requests still queued for the dead worker are dropped with its queue
+            self.requests[shard].cancel_join_thread()
+            connection.close()
+            self.restarts[shard] += 1
+            self.start_shard(shard)
+        for future in failed:
+            resolve(future, False, error)
+
+    def shard_of(self, city):
+        return self.city_shard.get(city, 0)
+
+    def submit(self, shard, command, *args):
+        # Send a request to a shard, returns a Future of its result
+        future = Future()
+        with self.lock:
+            request_id = next(self.request_ids)
+            self.futures[request_id] = (shard, future)
+            self.requests[shard].put((request_id, command) + args)
+        return future
+
+    def submit_match(self, traveller, plan, timeouts=None):
+        """
+        Match a new traveller on the shard of its arrival city, with the
+        stages of utils.async_pipeline and their timeouts.
+
+        Returns
+        -------
+        future (Future):  Of the PipelineResult.
+
+        """
+        return self.submit(self.shard_of(traveller.get('Arrival City')), 'match',
+                           traveller, plan, timeouts)
+
+    def match(self, traveller, plan, timeout=RESULT_TIMEOUT):
+        # Same as MatchEngine.match, on the traveller's shard
+        return self.submit_match(traveller, plan).result(timeout).result
+
+    def match_many(self, travellers, plan, timeout=RESULT_TIMEOUT):
+        # One batch per shard, run on the shards in parallel, results in input order
+        by_shard = {}
+        for position, traveller in enumerate(travellers):
+            by_shard.setdefault(self.shard_of(traveller.get('Arrival City')), []).append(position)
+        futures = {shard: self.submit(shard, 'match_many',
+                                      [travellers[position] for position in positions], plan)
+                   for shard, positions in by_shard.items()}
+        deadline = time.monotonic() + timeout
+        results = [None] * len(travellers)
+        for shard, positions in by_shard.items():
+            shard_results = futures[shard].result(max(deadline - time.monotonic(), 0))
+            for position, result in zip(positions, shard_results):
+                results[position] = result
+        return results
+
+    def stats(self, timeout=RESULT_TIMEOUT):
+        # Cities, trips, restarts and result cache statistics of every shard
+        futures = [self.submit(shard, 'stats') for shard in range(len(self.shards))]
+        deadline = time.monotonic() + timeout
+        return [dict(future.result(max(deadline - time.monotonic(), 0)),
+                     restarts=self.restarts[shard])
+                for shard, future in enumerate(futures)]
+
+    def close(self):
+        with self.lock:
+            self.closing = True
+        for requests in self.requests:
+            requests.put(None)
+        for process in self.processes:
+            process.join()
+        self.dispatcher.join()
+        for connection in self.connections:
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,213 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from utils.dataset import DATASET_CSV_PATH
+from utils.interest_sentiment import INTERESTS
+from utils.trip_index import DATE_FORMAT
+
+CITIES_PATH = './src/data/datasets/cities.txt'
+COMPANIES_PATH = './src/data/datasets/companies.txt'
+
+MOODS = ['Relaxation', 'Sightseeing', 'Adventure', 'Any']
+TIMES = ['Mornings', 'Evenings']
+HOTELS = ['Hilton Hotel', 'The Hotel', 'Ibis Hotel', 'Elite Hotel', 'Novotel']
+MIN_DURATION = 3
+MAX_DURATION = 14
+
+# Sentences appended to some tweets so the Premium: Interest plan has matches
+INTEREST_TEMPLATES = [
+    'Looking forward to some {} in {}!',
+    'Any tips for {} in {}?',
+    'So much {} planned for {} this time.'
+]
+
+def read_lines(path):
+    with open(path, 'r') as file:
+        return [line.strip() for line in file if line.strip()]
+
+class Vocabulary:
+    """
+    The values a synthetic traveller is drawn from: cities and companies from
+    their lists, and names, tweets and genre/club pairs from a real dataset.
+
+    Arguments
+    ---------
+    csv_path (str):        Real traveller CSV to take names, tweets and
+                           genres from.
+    cities_path (str):     One city per line.
+    companies_path (str):  One company per line.
+
+    """
+
+    def __init__(self, csv_path=DATASET_CSV_PATH, cities_path=CITIES_PATH,
+                 companies_path=COMPANIES_PATH):
+        df = pd.read_csv(csv_path, usecols=['Traveller Name', 'tweet', 'Music Genre',
+                                            'Suggested Club/Pub'])
+        names = df['Traveller Name'].str.split(' ', n=1, expand=True)
+        self.first_names = np.array(names[0].unique(), dtype=object)
+        self.last_names = np.array(names[1].dropna().unique(), dtype=object)
+        self.tweets = np.array(df['tweet'].astype(str), dtype=object)
+        clubs = df.drop_duplicates('Music Genre').sort_values('Music Genre')
+        self.genres = clubs['Music Genre'].tolist()
+        self.clubs = clubs['Suggested Club/Pub'].tolist()
+        self.cities = read_lines(cities_path)
+        self.companies = read_lines(companies_path)
+        self.interests = np.array(sorted({keyword for keywords in INTERESTS.values()
+                                          for keyword in keywords}), dtype=object)
+
+def seasonal_weights(n_days, peak_day=196, amplitude=0.5):
+    # Arrival probability per day of year, highest around peak_day (mid July)
+    days = np.arange(n_days)
+    weights = 1 + amplitude * np.cos(2 * np.pi * (days - peak_day) / n_days)
+    return weights / weights.sum()
+
+def popularity_weights(n, skew=1.0):
+    # Zipf-like weights: the first items are the most popular
+    weights = 1 / np.arange(1, n + 1) ** skew
+    return weights / weights.sum()
+
+def categorical(codes, categories):
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+def generate_chunk(vocabulary, rng, first_trip_id, n_rows, year=2024, n_years=1,
+                   peak_day=196, amplitude=0.5, city_skew=1.0, interest_share=0.3):
+    """
+    Generate n_rows synthetic travellers in one vectorized pass.
+
+    Arguments
+    ---------
+    vocabulary (Vocabulary):  Values to draw from.
+    rng (Generator):          numpy random generator.
+    first_trip_id (int):      Trip ID of the first row.
+    n_rows (int):             Number of travellers.
+    year (int):               First year of arrivals.
+    n_years (int):            Number of years arrivals are spread over.
+    peak_day (int):           Day of the year with the most arrivals.
+    amplitude (float):        Strength of the seasonality (0 for none).
+    city_skew (float):        Zipf exponent of the arrival city popularity.
+    interest_share (float):   Share of tweets that mention an interest.
+
+    Returns
+    -------
+    df (DataFrame):  Travellers in the dataset's typed layout.
+
+    """
+    # Seasonal arrival dates and trip durations
+    start = pd.Timestamp(year=year, month=1, day=1)
+    n_days = 365
+    day_of_year = rng.choice(n_days, size=n_rows, p=seasonal_weights(n_days, peak_day, amplitude))
+    arrivals = (start.to_datetime64().astype('datetime64[D]') +
+                365 * rng.integers(0, n_years, size=n_rows) + day_of_year)
+    returns = arrivals + rng.integers(MIN_DURATION, MAX_DURATION + 1, size=n_rows)
+
+    # Popular arrival cities, and a different departure city
+    n_cities = len(vocabulary.cities)
+    arrival_city = rng.choice(n_cities, size=n_rows, p=popularity_weights(n_cities, city_skew))
+    departure_city = rng.integers(0, n_cities - 1, size=n_rows)
+    departure_city += departure_city >= arrival_city
+
+    names = (vocabulary.first_names[rng.integers(0, len(vocabulary.first_names), size=n_rows)] +
+             ' ' + vocabulary.last_names[rng.integers(0, len(vocabulary.last_names), size=n_rows)])
+
+    # Real tweets, some with an interest sentence appended
+    tweets = vocabulary.tweets[rng.integers(0, len(vocabulary.tweets), size=n_rows)]
+    mentions = np.flatnonzero(rng.random(n_rows) < interest_share)
+    if len(mentions):
+        templates = rng.integers(0, len(INTEREST_TEMPLATES), size=len(mentions))
+        keywords = vocabulary.interests[rng.integers(0, len(vocabulary.interests),
+                                                     size=len(mentions))]
+        cities = np.array(vocabulary.cities, dtype=object)[arrival_city[mentions]]
+        tweets[mentions] = [tweet + ' ' + INTEREST_TEMPLATES[template].format(keyword, city)
+                            for tweet, template, keyword, city
+                            in zip(tweets[mentions], templates, keywords, cities)]
+
+    genre = rng.integers(0, len(vocabulary.genres), size=n_rows)
+    return pd.DataFrame({
+        'Trip ID': np.arange(first_trip_id, first_trip_id + n_rows),
+        'Traveller Name': names,
+        'Arrival Date': arrivals.astype('datetime64[ns]'),
+        'Return Date': returns.astype('datetime64[ns]'),
+        'Departure City': categorical(departure_city, vocabulary.cities),
+        'Arrival City': categorical(arrival_city, vocabulary.cities),
+        'company': categorical(rng.integers(0, len(vocabulary.companies), size=n_rows),
+                               vocabulary.companies),
+        'networking': rng.random(n_rows) < 0.5,
+        'mood': categorical(rng.integers(0, len(MOODS), size=n_rows), MOODS),
+        'free_time': categorical(rng.integers(0, len(TIMES), size=n_rows), TIMES),
+        'accommodation': categorical(rng.integers(0, len(HOTELS), size=n_rows), HOTELS),
+        'tweet': tweets,
+        'Music Genre': categorical(genre, vocabulary.genres),
+        'Suggested Club/Pub': categorical(genre, vocabulary.clubs)
+    })
+
+def generate_chunks(n_rows, chunk_size=100000, seed=0, vocabulary=None, **options):
+    """
+    Yield n_rows synthetic travellers in chunks of at most chunk_size rows,
+    so any number of rows can be produced in bounded memory. The same seed
+    and chunk size always give the same data.
+
+    Arguments
+    ---------
+    n_rows (int):             Total number of travellers.
+    chunk_size (int):         Rows per chunk.
+    seed (int):               Random seed.
+    vocabulary (Vocabulary):  Values to draw from, loaded if not given.
+    **options:                Passed on to generate_chunk.
+
+    """
+    vocabulary = vocabulary or Vocabulary()
+    n_chunks = -(-n_rows // chunk_size)
+    for chunk_id, chunk_seed in enumerate(np.random.SeedSequence(seed).spawn(n_chunks)):
+        first_row = chunk_id * chunk_size
+        yield generate_chunk(vocabulary, np.random.default_rng(chunk_seed), first_row + 1,
+                             min(chunk_size, n_rows - first_row), **options)
+
+def generate_dataset(n_rows, seed=0, **options):
+    # The whole dataset in memory, for benchmarks and small datasets
+    return pd.concat(generate_chunks(n_rows, seed=seed, **options), ignore_index=True)
+
+def write_dataset(path, n_rows, chunk_size=100000, seed=0, **options):
+    """
+    Stream a synthetic dataset to disk: a CSV in the layout of the original
+    data (dd/mm/YYYY dates) or, for a .parquet path, the typed Parquet
+    layout read by load_dataset.
+
+    Returns
+    -------
+    n_written (int):  Number of rows written.
+
+    Raises
+    ------
+    ValueError:  If n_rows is less than 1.
+
+    """
+    if n_rows < 1:
+        raise ValueError(f'Cannot write a dataset of {n_rows} rows')
+    n_written = 0
+    writer = None
+    tmp_path = f'{path}.tmp'
+    try:
+        for chunk in generate_chunks(n_rows, chunk_size, seed, **options):
+            if path.endswith('.parquet'):
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                writer = writer or pq.ParquetWriter(tmp_path, table.schema)
+                writer.write_table(table)
+            else:
+                for column in ['Arrival Date', 'Return Date']:
+                    chunk[column] = chunk[column].dt.strftime(DATE_FORMAT)
+                chunk.to_csv(tmp_path, index=False, mode='w' if n_written == 0 else 'a',
+                             header=n_written == 0)
+            n_written += len(chunk)
+    except BaseException:
+        # Don't leave a partial temporary file behind
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if writer is not None:
+        writer.close()
+    os.replace(tmp_path, path)
+    return n_written
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+from utils.instrumentation import stage
+
+DATE_FORMAT = '%d/%m/%Y'
+
+@stage('parse_dates')
+def parse_dates(dates):
+    """
+    Convert dd/mm/YYYY strings (or date objects) to datetimes, leaving
+    columns that are already datetimes untouched.
+
+    """
+    if isinstance(dates, pd.Series) and pd.api.types.is_datetime64_any_dtype(dates):
+        return dates
+    return pd.to_datetime(dates, format=DATE_FORMAT)
+
+def to_day_numbers(dates):
+    # Days since the epoch as int32, the unit all interval queries work in
+    dates = pd.DatetimeIndex(np.atleast_1d(parse_dates(dates)))
+    return dates.values.astype('datetime64[D]').astype('int32')
+
+class CityPartition:
+    """
+    The trips arriving in one city, sorted by arrival day. Since no trip is
+    longer than max_duration, every trip overlapping [start, end] arrived in
+    [start - max_duration, end], a contiguous slice found by binary search.
+
+    """
+    __slots__ = ('positions', 'arrivals', 'returns', 'max_duration')
+
+    def __init__(self, positions, arrivals, returns):
+        order = np.argsort(arrivals, kind='stable')
+        self.positions = positions[order]
+        self.arrivals = arrivals[order]
+        self.returns = returns[order]
+        self.max_duration = int((self.returns - self.arrivals).max())
+
+    def overlapping(self, start, end):
+        lo = np.searchsorted(self.arrivals, start - self.max_duration, side='left')
+        hi = np.searchsorted(self.arrivals, end, side='right')
+        overlaps = self.returns[lo:hi] >= start
+        return self.positions[lo:hi][overlaps]
+
+class TripIndex:
+    """
+    Index of trips by arrival city and date interval, built once at load time
+    to answer "who is in city X overlapping [a, b]" without scanning the
+    whole dataframe.
+
+    Arguments
+    ---------
+    df (DataFrame):  Traveller data with 'Arrival City', 'Arrival Date'
+                     and 'Return Date' columns.
+
+    """
+
+    def __init__(self, df):
+        self.df = df
+        arrivals = to_day_numbers(df['Arrival Date'])
+        returns = to_day_numbers(df['Return Date'])
+        self.partitions = {
+            city: CityPartition(positions, arrivals[positions], returns[positions])
+            for city, positions in df.groupby('Arrival City', sort=False, observed=True)\
+                .indices.items()
+        }
+
+    def query(self, city, arrival_date, return_date):
+        """
+        Return the row positions (in df order) of the trips to city that
+        overlap [arrival_date, return_date].
+
+        """
+        return self.query_days(city, to_day_numbers(arrival_date)[0],
+                               to_day_numbers(return_date)[0])
+
+    def query_days(self, city, start, end):
+        # Same as query, with the dates as day numbers
+        partition = self.partitions.get(city)
+        if partition is None:
+            return np.empty(0, dtype='int64')
+        return np.sort(partition.overlapping(start, end))
+
+    def get_simultaneous_travellers(self, new_traveller):
+        positions = self.query(new_traveller['Arrival City'],
+                               new_traveller['Arrival Date'],
+                               new_traveller['Return Date'])
+        return self.df.iloc[positions]
@@ -1,16 +1,36 @@
+import logging
 import pandas as pd
-from utils.interest_sentiment import main as get_interest_sentiment
-from utils.psychology_sentiment import main as get_psychology_sentiment
+from utils.interest_sentiment import (
+    main as get_interest_sentiment, 
+    process_data, 
+    INTERESTS, 
+    SENTIMENT_LABELS
+)
+from utils.psychology_sentiment import (
+    main as get_psychology_sentiment, 
+    extract_features, 
+    PERSONALITY_LABELS
+)
+from utils.feature_store import attach_features
+from utils.instrumentation import count, stage
+from utils.records import TravellerRecord
+from utils.trip_index import parse_dates
 
-def get_simultaneous_travellers(df, new_traveller):
+logger = logging.getLogger(__name__)
+
+@stage('simultaneous_filter')
+def get_simultaneous_travellers(df, new_traveller, trip_index=None):
     """
     Identify travellers who will be in the same city during 
     the overlapping date range of a new traveller.
 
     Arguments
     ---------
-    df (DataFrame):        The dataframe containing existing traveller data.
-    new_traveller (dict):  A DataFrame row with travel info of the new traveller.
+    df (DataFrame):          The dataframe containing existing traveller data.
+    new_traveller (dict):    A DataFrame row with travel info of the new traveller.
+    trip_index (TripIndex):  Optional prebuilt index over df. If given, the 
+                             query is answered by the index instead of 
+                             scanning df.
     
     Returns
     -------
@@ -19,30 +39,42 @@ def get_simultaneous_travellers(df, new_traveller):
                                           during the overlapping timeframe.
 
     """
-    # Convert the dates in the dataframe to datetime format if not already done
-    df['Arrival Date'] = pd.to_datetime(df['Arrival Date'], 
-                                          format='%d/%m/%Y')
-    df['Return Date'] = pd.to_datetime(df['Return Date'], 
-                                       format='%d/%m/%Y')
+    if trip_index is not None:
+        return trip_index.get_simultaneous_travellers(new_traveller)
+
+    # Convert the dates to datetime format if not already done
+    arrival_dates = parse_dates(df['Arrival Date'])
+    return_dates = parse_dates(df['Return Date'])
     
     # Extract data from the new traveller row
     arrival_city = new_traveller['Arrival City']
-    arrival_date = pd.to_datetime(new_traveller['Arrival Date'], 
-                                    format='%d/%m/%Y')
-    return_date = pd.to_datetime(new_traveller['Return Date'], 
-                                 format='%d/%m/%Y')
+    arrival_date = parse_dates(new_traveller['Arrival Date'])
+    return_date = parse_dates(new_traveller['Return Date'])
     
     # Filter for travellers who are going to the same city
-    same_city_travellers = df[df['Arrival City'] == arrival_city]
-
-    # Filter for date overlaps
-    simultaneous_travellers = same_city_travellers[
-        (same_city_travellers['Arrival Date'] <= return_date) &
-        (same_city_travellers['Return Date'] >= arrival_date)
+    # and whose dates overlap
+    simultaneous_travellers = df[
+        column_equals(df['Arrival City'], arrival_city) &
+        (arrival_dates <= return_date) &
+        (return_dates >= arrival_date)
     ]
     
     return simultaneous_travellers
 
+def column_equals(column, value):
+    """
+    Element-wise column == value. Categorical columns are compared on their
+    integer codes rather than on the string values.
+
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        code = column.cat.categories.get_indexer([value])[0]
+        if code == -1:
+            return pd.Series(False, index=column.index)
+        return pd.Series(column.cat.codes.values == code, index=column.index)
+    return column == value
+
+@stage('basic_filter')
 def get_basic_similar_travellers(df, new_traveller):
     """"
     Identify travellers who share similar interests in free time and networking.
@@ -61,73 +93,390 @@ def get_basic_similar_travellers(df, new_traveller):
     
     """
 
-    # Filter for travellers who have the same free time preference
-    similar_travellers = df[df['free_time'] == new_traveller['free_time']]
-
-    # Further filter for matching mood preference
-    similar_travellers = similar_travellers[
-        similar_travellers['mood'] == new_traveller['mood']
-    ]
+    # Filter for travellers who have the same free time and mood preference
+    mask = column_equals(df['free_time'], new_traveller['free_time'])
+    mask &= column_equals(df['mood'], new_traveller['mood'])
     
     # Further filter for matching networking preference
-    similar_travellers = similar_travellers[
-        similar_travellers['networking'] == new_traveller['networking']
-    ]
+    mask &= df['networking'] == new_traveller['networking']
     
     # If networking is True, filter to only match new people,
     # i.e., people outside the company
+    same_company = column_equals(df['company'], new_traveller['company'])
     if new_traveller['networking']:
-        similar_travellers = similar_travellers[
-            similar_travellers['company'] != new_traveller['company']
-        ]
+        mask &= ~same_company
     # If networking is False, only match people from the company
     else:
-        similar_travellers = similar_travellers[
-            similar_travellers['company'] == new_traveller['company']
-        ]
+        mask &= same_company
+    
+    similar_travellers = df[mask]
     
     return similar_travellers
 
+def get_cluster_members(all_travellers, new_features, cluster_model):
+    """
+    Assign the new traveller with a persisted cluster model and return the 
+    travellers the model assigned to the same cluster.
+
+    Arguments
+    ---------
+    all_travellers (DataFrame):   The dataframe containing existing traveller data.
+    new_features (DataFrame):     The new traveller's model features.
+    cluster_model (ClusterModel): A fitted model from utils.cluster_model.
+
+    Returns
+    -------
+    members (DataFrame):  A subset of all_travellers in the same cluster.
+
+    """
+    cluster = cluster_model.predict(new_features)[0]
+    assignments = cluster_model.assignments
+    member_ids = assignments.index[assignments.values == cluster]
+    return all_travellers[all_travellers['Trip ID'].isin(member_ids)]
+
+def get_local_cluster_members(candidates, candidate_features, new_features, cluster_model):
+    """
+    Assign the new traveller and the candidates with a persisted cluster 
+    model and return the candidates in the new traveller's cluster.
+
+    Arguments
+    ---------
+    candidates (DataFrame):          Candidate travellers.
+    candidate_features (DataFrame):  Model features of (a subset of) the 
+                                     candidates, with the same index.
+    new_features (DataFrame):        The new traveller's model features.
+    cluster_model (ClusterModel):    The global reference model.
+
+    Returns
+    -------
+    members (DataFrame):  A subset of candidates in the same cluster.
+
+    """
+    cluster = cluster_model.predict(new_features)[0]
+    if candidate_features.empty:
+        return candidates.iloc[0:0]
+    clusters = cluster_model.predict(candidate_features)
+    return candidates.loc[candidate_features.index[clusters == cluster]]
+
+def get_premium_interest_local_travellers(simultaneous_travellers,
+                                          new_traveller,
+                                          cluster_model,
+                                          feature_store=None):
+    """
+    Interest matching restricted to the simultaneous travellers: only their
+    sentiment is looked up in the feature store (or scored if missing), and
+    they are assigned with the global interest cluster model, so the work 
+    grows with the local candidates rather than the whole population.
+
+    Arguments
+    ---------
+    simultaneous_travellers (DataFrame):  Travellers in the same city during
+                                          the new traveller's dates.
+    new_traveller (DataFrame):            A one-row DataFrame with the new traveller.
+    cluster_model (ClusterModel):         The persisted interest cluster model.
+    feature_store (DataFrame):            Optional precomputed tweet features.
+
+    Returns
+    -------
+    matching_travellers (DataFrame):  The simultaneous travellers in the same
+                                      interest cluster as the new traveller.
+
+    """
+    new_features = process_data(new_traveller.copy(), INTERESTS)
+    if new_features.empty:
+        return simultaneous_travellers.iloc[0:0]
+
+    candidates = simultaneous_travellers
+    if feature_store is not None:
+        candidates = attach_features(candidates, feature_store, SENTIMENT_LABELS)
+    candidate_features = process_data(candidates.copy(), INTERESTS)
+    return get_local_cluster_members(simultaneous_travellers, candidate_features,
+                                     new_features, cluster_model)
+
+def get_premium_psychology_local_travellers(simultaneous_travellers,
+                                            new_traveller,
+                                            cluster_model,
+                                            feature_store=None):
+    """
+    Psychology matching restricted to the simultaneous travellers, assigned
+    with the global psychology cluster model. Only their traits are looked 
+    up (or scored if missing).
+
+    Returns
+    -------
+    matching_travellers (DataFrame):  The simultaneous travellers in the same
+                                      personality cluster as the new traveller.
+
+    """
+    new_features = extract_features(new_traveller)
+
+    candidates = simultaneous_travellers
+    if feature_store is not None:
+        candidates = attach_features(candidates, feature_store, PERSONALITY_LABELS)
+    candidate_features = extract_features(candidates)
+    candidate_features.index = simultaneous_travellers.index
+    return get_local_cluster_members(simultaneous_travellers, candidate_features,
+                                     new_features, cluster_model)
+
+def get_clustering_input(all_travellers, new_traveller, feature_store, labels):
+    """
+    The population plus the new traveller, with only the columns clustering
+    needs (Trip ID, name, tweet and the stored features), so the whole 
+    population frame is not copied.
+
+    """
+    columns = ['Trip ID', 'Traveller Name', 'tweet']
+    travellers = all_travellers[columns]
+    if feature_store is not None:
+        travellers = attach_features(travellers, feature_store, labels)
+    new_columns = [column for column in new_traveller.columns 
+                   if column in columns or column in labels]
+    return pd.concat([travellers, new_traveller[new_columns]], ignore_index=True)
+
+def select_by_names(all_travellers, names):
+    # Travellers with one of the names, except the new traveller ('Me')
+    travellers_names = all_travellers['Traveller Name']
+    return all_travellers[travellers_names.isin(names) & (travellers_names != 'Me')]
+
 def get_premium_interest_matching_travellers(all_travellers, 
-                                             new_traveller):
+                                             new_traveller,
+                                             feature_store=None,
+                                             cluster_model=None):
+    """
+    Identify travellers whose tweets about shared interests fall in the same 
+    sentiment cluster as the new traveller's tweet.
+
+    Arguments
+    ---------
+    all_travellers (DataFrame):   The dataframe containing existing traveller data.
+    new_traveller (DataFrame):    A one-row DataFrame with the new traveller.
+    feature_store (DataFrame):    Optional precomputed tweet features indexed by
+                                  Trip ID. Only tweets missing from it are scored.
+    cluster_model (ClusterModel): Optional persisted interest cluster model. If 
+                                  given, only the new tweet is scored and 
+                                  assigned, nothing is refitted.
+
+    Returns
+    -------
+    matching_travellers (DataFrame):  A subset of all_travellers in the same
+                                      interest cluster as the new traveller.
+
+    """
+    if cluster_model is not None:
+        new_features = process_data(new_traveller.copy(), INTERESTS)
+        if new_features.empty:
+            return all_travellers.iloc[0:0]
+        return get_cluster_members(all_travellers, new_features, cluster_model)
+
     # Get interest groups
-    new_simultaneous_travellers = pd.concat([all_travellers, 
-                                             new_traveller], ignore_index=True)
+    new_simultaneous_travellers = get_clustering_input(all_travellers, new_traveller,
+                                                       feature_store, SENTIMENT_LABELS)
     grouped_travellers = get_interest_sentiment(new_simultaneous_travellers)
 
     # Get interest match names
-    interest_match_names = None
+    interest_match_names = set()
     for cluster, names in grouped_travellers:
         if 'Me' in names.tolist():
             interest_match_names = set(names.tolist())
 
-    matching_travellers = new_simultaneous_travellers[
-        new_simultaneous_travellers['Traveller Name'].isin(interest_match_names)
-    ]
-
-    matching_travellers = matching_travellers[matching_travellers['Traveller Name'] != 'Me']
-    matching_travellers = matching_travellers.iloc[:, :-3]
+    matching_travellers = select_by_names(all_travellers, interest_match_names)
 
     return matching_travellers
 
 def get_premium_psychology_matching_travellers(all_travellers,
-                                               new_traveller):
+                                               new_traveller,
+                                               feature_store=None,
+                                               cluster_model=None):
+    """
+    Identify travellers whose Big-Five personality profile falls in the same
+    cluster as the new traveller's.
+
+    Arguments
+    ---------
+    all_travellers (DataFrame):   The dataframe containing existing traveller data.
+    new_traveller (DataFrame):    A one-row DataFrame with the new traveller.
+    feature_store (DataFrame):    Optional precomputed tweet features indexed by
+                                  Trip ID. Only tweets missing from it are scored.
+    cluster_model (ClusterModel): Optional persisted psychology cluster model. 
+                                  If given, only the new tweet is scored and 
+                                  assigned, nothing is refitted.
+
+    Returns
+    -------
+    matching_travellers (DataFrame):  A subset of all_travellers in the same
+                                      personality cluster as the new traveller.
+
+    """
+    if cluster_model is not None:
+        new_features = extract_features(new_traveller)
+        return get_cluster_members(all_travellers, new_features, cluster_model)
+
     # Get interest groups
-    new_simultaneous_travellers = pd.concat([all_travellers, 
-                                             new_traveller], ignore_index=True)
+    new_simultaneous_travellers = get_clustering_input(all_travellers, new_traveller,
+                                                       feature_store, PERSONALITY_LABELS)
     grouped_travellers = get_psychology_sentiment(new_simultaneous_travellers)
 
     # Get interest match names
     psychology_match_names = []
-    interest_match_names = None
     for cluster, names in grouped_travellers:
         if (names['Traveller Name'] == 'Me').any():
             psychology_match_names.extend(names['Traveller Name'].tolist())
 
-    matching_travellers = new_simultaneous_travellers[
-        new_simultaneous_travellers['Traveller Name'].isin(psychology_match_names)
-    ]
-    
-    matching_travellers = matching_travellers[matching_travellers['Traveller Name'] != 'Me']
+    matching_travellers = select_by_names(all_travellers, psychology_match_names)
+
+    return matching_travellers
+
+def get_premium_psychology_nearest_travellers(simultaneous_travellers,
+                                              new_traveller,
+                                              personality_index,
+                                              n_neighbours=10):
+    """
+    Identify the simultaneous travellers with the closest Big-Five 
+    personality profile to the new traveller's.
+
+    Arguments
+    ---------
+    simultaneous_travellers (DataFrame):  Travellers in the same city during
+                                          the new traveller's dates, used as
+                                          the candidate pre-filter.
+    new_traveller (DataFrame):            A one-row DataFrame with the new traveller.
+    personality_index (PersonalityIndex): Index over the stored traits.
+    n_neighbours (int):                   Maximum number of matches.
+
+    Returns
+    -------
+    matching_travellers (DataFrame):  Up to n_neighbours simultaneous 
+                                      travellers, closest first. Travellers
+                                      missing from the index (their tweets
+                                      were not scored yet) can't be matched;
+                                      they are logged and counted.
+
+    """
+    candidate_ids = simultaneous_travellers['Trip ID'].values
+    n_unindexed = int((personality_index.positions.get_indexer(candidate_ids) < 0).sum())
+    if n_unindexed:
+        count('unindexed_candidates', n_unindexed)
+        logger.warning('%d of %d simultaneous travellers have no stored personality '
+                       'and were skipped', n_unindexed, len(candidate_ids))
+
+    new_features = extract_features(new_traveller)
+    trip_ids, _ = personality_index.query(new_features, 
+                                          k=n_neighbours,
+                                          candidate_ids=candidate_ids)
+    matching_travellers = simultaneous_travellers.set_index('Trip ID', drop=False)\
+        .loc[trip_ids]\
+        .reset_index(drop=True)
+
+    return matching_travellers
+
+def get_matching_travellers(all_travellers, new_traveller, plan, trip_index=None,
+                            feature_store=None, cluster_models=None,
+                            personality_index=None, n_neighbours=10,
+                            premium_scope='global', encoded=None):
+    """
+    Run the matching pipeline of a subscription plan: basic matches for
+    every plan, plus interest or psychology matches for the Premium plans.
+
+    Arguments
+    ---------
+    all_travellers (DataFrame):  The dataframe containing existing traveller data.
+    new_traveller (DataFrame):   A one-row DataFrame with the new traveller.
+    plan (str):                  'Basic', 'Premium: Interest' or 'Premium: Psychology'.
+    trip_index (TripIndex):      Optional prebuilt index over all_travellers.
+    feature_store (DataFrame):   Optional precomputed tweet features.
+    cluster_models (dict):       Optional persisted cluster models by name
+                                 ('interest', 'psychology').
+    personality_index (PersonalityIndex):  If given, 'Premium: Psychology' 
+                                 matches the n_neighbours closest 
+                                 personalities instead of the same cluster.
+    n_neighbours (int):          Maximum number of nearest-neighbour matches.
+    premium_scope (str):         'global' assigns the Premium plans against 
+                                 the whole population, 'local' only looks up 
+                                 features of the simultaneous travellers and 
+                                 assigns them with the cluster models (if the
+                                 plan's model is given).
+    encoded (EncodedTravellers): Optional code arrays of all_travellers. With
+                                 a trip_index, the city/date and basic filters
+                                 run on them and only matching rows are copied.
+
+    Returns
+    -------
+    matching_travellers (DataFrame):  The travellers matched to the new one.
+
+    """
+    cluster_models = cluster_models or {}
+    traveller = new_traveller.iloc[0]
+
+    if encoded is not None and trip_index is not None:
+        # Filter on row positions, only the matches are materialized
+        record = TravellerRecord.from_dict(traveller.to_dict())
+        with stage('simultaneous_filter'):
+            positions = trip_index.query_days(record.arrival_city,
+                                              record.arrival_day,
+                                              record.return_day)
+        with stage('basic_filter'):
+            matching_travellers = all_travellers.iloc[encoded.basic_matches(positions, record)]
+        if plan == 'Basic':
+            return matching_travellers
+        simultaneous_travellers = all_travellers.iloc[positions]
+    else:
+        # Get simultaneous travellers
+        simultaneous_travellers = get_simultaneous_travellers(all_travellers, 
+                                                              traveller,
+                                                              trip_index)
+
+        # Get similar travellers
+        matching_travellers = get_basic_similar_travellers(simultaneous_travellers,
+                                                           traveller)
+        if plan == 'Basic':
+            return matching_travellers
+
+    local = premium_scope == 'local'
+    if plan == 'Premium: Interest' and local and cluster_models.get('interest') is not None:
+        premium_matching_travellers = get_premium_interest_local_travellers(
+            simultaneous_travellers,
+            new_traveller,
+            cluster_models['interest'],
+            feature_store
+        )
+    elif plan == 'Premium: Interest':
+        premium_matching_travellers = get_premium_interest_matching_travellers(
+            all_travellers,
+            new_traveller,
+            feature_store,
+            cluster_models.get('interest')
+        )
+    elif plan == 'Premium: Psychology' and personality_index is not None:
+        premium_matching_travellers = get_premium_psychology_nearest_travellers(
+            simultaneous_travellers,
+            new_traveller,
+            personality_index,
+            n_neighbours
+        )
+    elif plan == 'Premium: Psychology' and local and cluster_models.get('psychology') is not None:
+        premium_matching_travellers = get_premium_psychology_local_travellers(
+            simultaneous_travellers,
+            new_traveller,
+            cluster_models['psychology'],
+            feature_store
+        )
+    elif plan == 'Premium: Psychology':
+        premium_matching_travellers = get_premium_psychology_matching_travellers(
+            all_travellers,
+            new_traveller,
+            feature_store,
+            cluster_models.get('psychology')
+        )
+    else:
+        raise ValueError(f'Unknown plan: {plan}')
 
-    return matching_travellers
\ No newline at end of file
+    premium_matching_travellers = get_simultaneous_travellers(premium_matching_travellers,
+                                                              traveller)
+
+    # Merge
+    with stage('merge'):
+        matching_travellers = pd.concat([matching_travellers,
+                                         premium_matching_travellers], ignore_index=True)
+        matching_travellers = matching_travellers.drop_duplicates()
+
+    return matching_travellers